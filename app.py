@@ -1,95 +1,388 @@
+"""Flask front end for the D&D commodity market.
+
+Each request reads one immutable MarketSnapshot, so pages and JSON never mix two
+market versions even while another thread is applying a tick.
+
+To serve from several processes, point every worker at the same state files:
+
+    gunicorn -k gevent -w 4 -b 0.0.0.0:5000 app:app
+
+Ticks and events take an exclusive flock on market_state.lock and are appended to
+market_state.log. Before answering, a worker notices when the log or snapshot has
+changed on disk and replays what the other workers wrote. Cross-process locking
+needs fcntl, so on Windows run a single process.
+
+/api/stream holds its connection open for as long as the client stays, which
+would tie up a whole sync worker (or a thread of the Flask server) per open tab.
+Under gevent every client is a greenlet waiting on the simulator's shared delta
+journal, so the dashboard and charts pages only open a stream there; elsewhere
+they show the market as of their last load. LIVE_STREAM=1 opens streams under
+any other async server, LIVE_STREAM=0 never does.
+
+/metrics serves request latencies, simulator timings, persisted bytes and state
+size in the Prometheus text format, per worker process. With PROFILE_REQUESTS=1,
+a request carrying ``X-Profile: 1`` or ``?profile=1`` is sampled while it runs
+and its collapsed stacks are written to PROFILE_DIR (``?profile=inline`` returns
+them instead of the page).
+"""
 import os
 import logging
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import threading
+import time
+import zlib
+import numpy as np
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, g, abort, Response
+from flask.json.provider import DefaultJSONProvider
+from markupsafe import Markup
+from campaigns import CampaignRegistry
+from forecast import run_forecast
+import market_batch
+from metrics import REGISTRY, SamplingProfiler
 from market_simulator import MarketSimulator
+from price_rollups import lttb
+from market_stream import sse_message
+from tick_scheduler import TickScheduler
+from trade_routes import DEFAULT_TRANSPORT_COST, MAX_HOPS
 from datetime import datetime
 
 logging.basicConfig(level=logging.DEBUG)
 
+class MarketJSONProvider(DefaultJSONProvider):
+    """JSON provider that understands the simulator's array-backed views"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        if isinstance(o, np.generic):
+            return o.item()
+        if hasattr(o, "to_dict"):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
 app = Flask(__name__)
+app.json = MarketJSONProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET", "dd_commodity_trading_secret_key_2024")
 
-# Initialize market simulator
-market_sim = MarketSimulator()
+# Initialize market simulator (VERIFY_ANALYTICS=1 cross-checks incremental analytics on every read;
+# WORLD_FILE=path loads another world definition than worlds/default.json; MARKET_SEED=n seeds a new market;
+# HISTORY_DAYS=n keeps n days of price history per cell, for every market)
+HISTORY_DAYS = int(os.environ.get("HISTORY_DAYS", 30))
+market_sim = MarketSimulator(seed=int(os.environ["MARKET_SEED"]) if "MARKET_SEED" in os.environ else None,
+                             history_days=HISTORY_DAYS,
+                             verify_analytics=os.environ.get("VERIFY_ANALYTICS") == "1",
+                             world=os.environ.get("WORLD_FILE"))
+
+# Longest day range one archive series request may replay
+ARCHIVE_MAX_DAYS = 3660
+
+# Most days one advance request may simulate (and log) at once
+MAX_ADVANCE_DAYS = int(os.environ.get("MAX_ADVANCE_DAYS", 3650))
+
+# Points a chart is drawn from at most; longer series are thinned by LTTB or merged into longer buckets
+CHART_POINTS = 500
+
+# Dashboard rows rendered with the page; the rest load in pages as the table scrolls into view
+DASHBOARD_EAGER_REGIONS = 20
+DASHBOARD_PAGE_REGIONS = 50
+
+# TICK_SECONDS=n advances the default market one day every n seconds of real time
+scheduler = None
+if os.environ.get("TICK_SECONDS"):
+    scheduler = TickScheduler(market_sim, float(os.environ["TICK_SECONDS"]),
+                              max_catch_up=int(os.environ.get("MAX_CATCH_UP_DAYS", 365))).start()
+
+# Streams check the state files for other workers' writes this often while idle
+STREAM_POLL_SECONDS = 1.0
+STREAM_KEEPALIVE_SECONDS = 15.0
+
+# Whether pages open live streams: "auto" only under gevent, "1" always, "0" never
+LIVE_STREAM = os.environ.get("LIVE_STREAM", "auto")
+
+def live_streams():
+    """Whether this worker can hold streams open without spending a worker or thread on each"""
+    if LIVE_STREAM != "auto":
+        return LIVE_STREAM == "1"
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+# Per-campaign markets under /c/<campaign>/... and /api/c/<campaign>/..., created by POST /api/campaigns
+# and loaded on first use
+campaigns = CampaignRegistry(
+    root=os.environ.get("CAMPAIGNS_DIR", "campaigns"),
+    max_loaded=int(os.environ.get("MAX_LOADED_CAMPAIGNS", 16)),
+    memory_budget=int(os.environ.get("CAMPAIGN_MEMORY_MB", 256)) * 1024 * 1024,
+    idle_seconds=float(os.environ["CAMPAIGN_IDLE_SECONDS"]) if "CAMPAIGN_IDLE_SECONDS" in os.environ else None,
+    history_days=HISTORY_DAYS,
+    verify_analytics=market_sim.verify_analytics,
+    world=os.environ.get("WORLD_FILE")
+)
+
+@app.context_processor
+def stream_settings():
+    return {"live_stream": live_streams()}
+
+@app.url_value_preprocessor
+def pull_campaign(endpoint, values):
+    g.campaign = values.pop('campaign', None) if values else None
+
+@app.url_defaults
+def add_campaign(endpoint, values):
+    # Links rendered inside a campaign stay inside that campaign
+    if g.get('campaign') and 'campaign' not in values and app.url_map.is_endpoint_expecting(endpoint, 'campaign'):
+        values['campaign'] = g.campaign
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to produce a response", labels=("endpoint", "method", "status"))
+RESPONSE_BYTES = REGISTRY.counter(
+    "http_response_bytes_total", "Bytes of response bodies with a known length", labels=("endpoint",))
+FRAGMENT_RENDERS = REGISTRY.counter(
+    "market_fragment_renders_total", "Page fragments rendered because their region changed", labels=("fragment",))
+REGISTRY.gauge("market_state_bytes", "Memory held by market arrays",
+               lambda: {("default",): market_sim.memory_usage(), ("campaigns",): campaigns.memory_usage()},
+               labels=("market",))
+REGISTRY.gauge("market_state_file_bytes", "Size of the default market's state files",
+               lambda: {(name,): os.path.getsize(path) if os.path.exists(path) else None
+                        for name, path in (("snapshot", market_sim.store.snapshot_file),
+                                           ("log", market_sim.store.log_file))},
+               labels=("file",))
+REGISTRY.gauge("market_version", "Version of the default market", lambda: market_sim.version)
+REGISTRY.gauge("market_day", "Simulated day of the default market", lambda: market_sim.day)
+REGISTRY.gauge("market_log_records", "Records logged since the last snapshot",
+               lambda: market_sim.store.seq - market_sim.store.snapshot_seq)
+REGISTRY.gauge("market_campaigns_loaded", "Campaign markets held in memory", lambda: len(campaigns.loaded()))
+REGISTRY.gauge("market_result_cache_hits", "Result cache hits of the default market",
+               lambda: market_sim.result_cache.hits)
+REGISTRY.gauge("market_result_cache_misses", "Result cache misses of the default market",
+               lambda: market_sim.result_cache.misses)
+REGISTRY.gauge("market_result_cache_bytes", "Serialized results held in the default market's result cache",
+               lambda: market_sim.result_cache.nbytes)
+
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    flag = request.args.get('profile') or request.headers.get('X-Profile')
+    if PROFILE_REQUESTS and flag:
+        g.profiler = SamplingProfiler(threading.get_ident()).start()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - g.pop('request_start'), endpoint, request.method,
+                            response.status_code)
+    if not response.is_streamed:
+        # Sizing a streamed response would drain its generator before the client sees it
+        RESPONSE_BYTES.inc(response.calculate_content_length() or 0, endpoint)
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        stacks = profiler.stop().collapsed()
+        if request.args.get('profile') == 'inline':
+            return app.response_class(stacks, mimetype='text/plain')
+        response.headers['X-Profile-File'] = save_profile(stacks, endpoint)
+    return response
+
+@app.teardown_request
+def finish_failed_request(exc):
+    # after_request is skipped when a view raises: count the request as a 500 and stop its profiler here
+    start = g.pop('request_start', None)
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, request.endpoint or "unmatched", request.method, 500)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        save_profile(profiler.stop().collapsed(), request.endpoint or "unmatched")
+
+def save_profile(stacks, endpoint):
+    """Write a request's collapsed stacks to PROFILE_DIR; returns the file's path"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{int(time.time() * 1000)}-{endpoint}.collapsed")
+    with open(path, 'w') as f:
+        f.write(stacks)
+    return path
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this worker process"""
+    return app.response_class(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/campaigns', methods=['POST'])
+def create_campaign():
+    """Start a new campaign market, or return the existing one with that id"""
+    params = request.get_json(silent=True) or request.form
+    campaign = params.get('campaign')
+    if not isinstance(campaign, str) or not campaigns.is_valid(campaign):
+        return jsonify({"error": "campaign must be 1-64 letters, digits, '_' or '-'"}), 400
+    existed = campaigns.exists(campaign)
+    sim = campaigns.get(campaign, create=True)
+    return jsonify({"campaign": campaign, "version": sim.version, "day": sim.day,
+                    "url": url_for('dashboard', campaign=campaign)}), 200 if existed else 201
+
+def current_sim():
+    """The simulator for the campaign in the URL, or the default market; 404 for unknown campaigns"""
+    if g.get('campaign') is None:
+        return market_sim
+    try:
+        sim = campaigns.get(g.campaign)
+    except KeyError:
+        abort(404)
+    if campaigns.idle_seconds is not None:
+        campaigns.evict_idle()
+    return sim
+
+def versioned_json(snapshot, key, compute):
+    """JSON response memoized per market version, with a strong ETag and If-None-Match support"""
+    etag = f"{snapshot.version}-{zlib.crc32(repr(key).encode()):08x}"
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body = snapshot.result_cache.get_or_compute(snapshot.version, ("json",) + key,
+                                                    lambda: app.json.dumps(compute()))
+        response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+def region_rows(snapshot, start, stop):
+    """Dashboard table rows for regions ``start`` to ``stop``, re-rendering only regions that changed"""
+    rows = []
+    for i in range(start, min(stop, len(snapshot.regions))):
+        def render(i=i):
+            FRAGMENT_RENDERS.inc(1, "dashboard_region")
+            return render_template('fragments/dashboard_region.html', row=snapshot.region_view(i))
+        rows.append(snapshot.fragments.get_or_render(("dashboard_region", i), int(snapshot.region_stamps[i]), render))
+    return Markup("".join(rows))
+
+def wants_json():
+    """True for scripted requests that asked for JSON instead of a redirect"""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
 
 @app.route('/')
+@app.route('/c/<campaign>/')
 def dashboard():
     """Main dashboard showing current market overview"""
-    market_data = market_sim.get_market_data()
-    regions = market_sim.get_regions()
-    commodities = market_sim.get_commodities()
-    last_events = market_sim.get_last_events()
+    snapshot = current_sim().snapshot()
+    regions = snapshot.get_regions()
+    commodities = snapshot.get_commodities()
+    last_events = snapshot.get_last_events()
+    more_regions_url = None
+    if len(regions) > DASHBOARD_EAGER_REGIONS:
+        more_regions_url = url_for('dashboard_rows', start=DASHBOARD_EAGER_REGIONS)
     
     return render_template('dashboard.html', 
-                         market_data=market_data,
+                         region_rows=region_rows(snapshot, 0, DASHBOARD_EAGER_REGIONS),
+                         more_regions_url=more_regions_url,
                          regions=regions,
                          commodities=commodities,
-                         last_events=last_events)
+                         last_events=last_events,
+                         version=snapshot.version,
+                         max_advance_days=MAX_ADVANCE_DAYS)
+
+@app.route('/api/dashboard_rows')
+@app.route('/api/c/<campaign>/dashboard_rows')
+def dashboard_rows():
+    """Rendered dashboard rows for the regions below the fold, a page at a time"""
+    snapshot = current_sim().snapshot()
+    start = max(request.args.get('start', 0, type=int), 0)
+    stop = start + DASHBOARD_PAGE_REGIONS
+    return jsonify({
+        "version": snapshot.version,
+        "html": region_rows(snapshot, start, stop),
+        "next": url_for('dashboard_rows', start=stop) if stop < len(snapshot.regions) else None
+    })
 
 @app.route('/regions')
+@app.route('/c/<campaign>/regions')
 def regions():
     """Regional comparison view"""
+    snapshot = current_sim().snapshot()
+    regions = snapshot.get_regions()
     export_region = request.args.get('export', 'Red Expanse')
     import_region = request.args.get('import', 'Solara')
+    if export_region not in snapshot.region_index:
+        export_region = regions[0]
+    if import_region not in snapshot.region_index:
+        import_region = regions[-1]
     
-    market_data = market_sim.get_market_data()
-    regions = market_sim.get_regions()
-    commodities = market_sim.get_commodities()
+    commodities = snapshot.get_commodities()
     
     # Calculate profit opportunities
-    profit_analysis = market_sim.calculate_profit_opportunities(export_region, import_region)
+    profit_analysis = snapshot.calculate_profit_opportunities(export_region, import_region)
+    top_trades = snapshot.calculate_top_trades(10)
+    trade_routes = snapshot.calculate_trade_routes(export_region, 3, 5)
     
     return render_template('regions.html',
-                         market_data=market_data,
                          regions=regions,
                          commodities=commodities,
                          export_region=export_region,
                          import_region=import_region,
-                         profit_analysis=profit_analysis)
+                         profit_analysis=profit_analysis,
+                         top_trades=top_trades,
+                         trade_routes=trade_routes)
 
 @app.route('/charts')
+@app.route('/c/<campaign>/charts')
 def charts():
     """Historical price charts view"""
+    snapshot = current_sim().snapshot()
+    regions = snapshot.get_regions()
+    commodities = snapshot.get_commodities()
     selected_commodity = request.args.get('commodity', 'wheat')
     selected_region = request.args.get('region', 'Red Expanse')
-    
-    market_data = market_sim.get_market_data()
-    regions = market_sim.get_regions()
-    commodities = market_sim.get_commodities()
+    if selected_commodity not in snapshot.commodity_index:
+        selected_commodity = snapshot.commodity_names[0]
+    if selected_region not in snapshot.region_index:
+        selected_region = regions[0]
+    history = snapshot.get_price_history(selected_region, selected_commodity, "raw", CHART_POINTS)
     
     return render_template('charts.html',
-                         market_data=market_data,
+                         price_history=history["history"].tolist(),
+                         history_positions=history["positions"].tolist(),
+                         history_length=history["length"],
+                         chart_points=CHART_POINTS,
                          regions=regions,
                          commodities=commodities,
                          selected_commodity=selected_commodity,
-                         selected_region=selected_region)
+                         selected_region=selected_region,
+                         day=snapshot.day,
+                         archive_start=current_sim().archive.start_day,
+                         version=snapshot.version)
 
 @app.route('/events')
+@app.route('/c/<campaign>/events')
 def events():
     """Event simulation view"""
-    regions = market_sim.get_regions()
-    available_events = market_sim.get_events_by_region()
-    event_history = market_sim.get_event_history()
+    snapshot = current_sim().snapshot()
+    regions = snapshot.get_regions()
+    available_events = snapshot.get_events_by_region()
+    event_history = snapshot.get_event_history()
     
     return render_template('events.html',
                          regions=regions,
                          available_events=available_events,
-                         event_history=event_history)
+                         event_history=event_history,
+                         scheduled_events=snapshot.get_scheduled_events(),
+                         day=snapshot.day)
 
 @app.route('/analytics')
+@app.route('/c/<campaign>/analytics')
 def analytics():
     """Market analytics and insights"""
-    market_data = market_sim.get_market_data()
-    regions = market_sim.get_regions()
-    commodities = market_sim.get_commodities()
+    snapshot = current_sim().snapshot()
+    regions = snapshot.get_regions()
+    commodities = snapshot.get_commodities()
     
     # Calculate market analytics
-    volatility_analysis = market_sim.calculate_volatility_analysis()
-    trend_analysis = market_sim.calculate_trend_analysis()
-    regional_performance = market_sim.calculate_regional_performance()
+    volatility_analysis = snapshot.calculate_volatility_analysis()
+    trend_analysis = snapshot.calculate_trend_analysis()
+    regional_performance = snapshot.calculate_regional_performance()
     
     return render_template('analytics.html',
-                         market_data=market_data,
                          regions=regions,
                          commodities=commodities,
                          volatility_analysis=volatility_analysis,
@@ -97,20 +390,72 @@ def analytics():
                          regional_performance=regional_performance)
 
 @app.route('/api/advance_day', methods=['POST'])
+@app.route('/api/c/<campaign>/advance_day', methods=['POST'])
 def advance_day():
     """Advance market by one day"""
-    market_sim.update_prices()
+    sim = current_sim()
+    sim.update_prices()
+    if wants_json():
+        return jsonify({"version": sim.version})
     flash('Market advanced by one day', 'success')
     return redirect(url_for('dashboard'))
 
+@app.route('/api/advance_days', methods=['POST'])
+@app.route('/api/c/<campaign>/advance_days', methods=['POST'])
+def advance_days():
+    """Advance market by several days with a single write"""
+    try:
+        days = int(request.form.get('days', 1))
+    except ValueError:
+        days = 0
+
+    if not 1 <= days <= MAX_ADVANCE_DAYS:
+        message = f'Number of days must be a whole number from 1 to {MAX_ADVANCE_DAYS}'
+        if wants_json():
+            return jsonify({"error": message}), 400
+        flash(message, 'error')
+    else:
+        sim = current_sim()
+        sim.advance_days(days)
+        if wants_json():
+            return jsonify({"version": sim.version})
+        flash(f'Market advanced by {days} days', 'success')
+    return redirect(url_for('dashboard'))
+
+@app.route('/api/scheduler')
+def scheduler_status():
+    """Status of the real-time tick scheduler"""
+    if scheduler is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(scheduler.status(), enabled=True))
+
+@app.route('/api/scheduler/<action>', methods=['POST'])
+def control_scheduler(action):
+    """Pause or resume the real-time tick scheduler"""
+    if action not in ('pause', 'resume'):
+        abort(404)
+    if scheduler is None:
+        return jsonify({"error": "The tick scheduler is not enabled; set TICK_SECONDS"}), 409
+    if action == 'pause':
+        scheduler.pause()
+    else:
+        scheduler.resume()
+    return jsonify(dict(scheduler.status(), enabled=True))
+
 @app.route('/api/trigger_event', methods=['POST'])
+@app.route('/api/c/<campaign>/trigger_event', methods=['POST'])
 def trigger_event():
-    """Trigger a specific event in a region"""
+    """Trigger a specific event in a region, optionally ``in_days`` ahead and fading over ``duration`` days"""
     region = request.form.get('region')
     event_index = int(request.form.get('event_index'))
+    in_days = request.form.get('in_days', 0, type=int)
+    duration = request.form.get('duration', type=int)
+    decay = request.form.get('decay', 1.0, type=float)
     
     if region and event_index is not None:
-        success, message = market_sim.trigger_event(region, event_index)
+        success, message = current_sim().trigger_event(region, event_index, in_days, duration, decay)
+        if wants_json():
+            return jsonify({"success": success, "message": message}), 200 if success else 400
         if success:
             flash(message, 'success')
         else:
@@ -120,20 +465,249 @@ def trigger_event():
     
     return redirect(url_for('events'))
 
+@app.route('/api/trigger_events', methods=['POST'])
+@app.route('/api/c/<campaign>/trigger_events', methods=['POST'])
+def trigger_events():
+    """Apply and schedule a JSON batch of events across regions atomically, e.g.
+    ``{"events": [{"region": ..., "event_index": 0, "in_days": 3, "duration": 7, "decay": 0.8}]}``"""
+    params = request.get_json(silent=True)
+    events = params.get('events') if isinstance(params, dict) else None
+    if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+        return jsonify({"success": False, "message": "events must be a list of objects"}), 400
+    try:
+        records = current_sim().trigger_events(events)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "message": f"{len(records)} events applied or scheduled", "events": records})
+
+@app.route('/api/scheduled_events')
+@app.route('/api/c/<campaign>/scheduled_events')
+def get_scheduled_events():
+    """API endpoint for the events waiting for their day, soonest first"""
+    snapshot = current_sim().snapshot()
+    return versioned_json(snapshot, ("scheduled_events",), lambda: {
+        "day": snapshot.day,
+        "scheduled": list(snapshot.get_scheduled_events()),
+        "active": list(snapshot.active_events)
+    })
+
 @app.route('/api/market_data/<region>')
+@app.route('/api/c/<campaign>/market_data/<region>')
 def get_market_data(region):
     """API endpoint for real-time market data"""
+    snapshot = current_sim().snapshot()
     if region == 'all':
-        data = market_sim.get_market_data()
-    else:
-        data = market_sim.get_region_data(region)
-    return jsonify(data)
+        return versioned_json(snapshot, ("market_data",), snapshot.get_market_data)
+    return versioned_json(snapshot, ("market_data", region), lambda: snapshot.get_region_data(region))
 
 @app.route('/api/price_history/<region>/<commodity>')
+@app.route('/api/c/<campaign>/price_history/<region>/<commodity>')
 def get_price_history(region, commodity):
-    """API endpoint for price history data"""
-    history = market_sim.get_price_history(region, commodity)
-    return jsonify(history)
+    """API endpoint for price history data, raw or as ``resolution=daily|weekly|monthly`` OHLC buckets,
+    at most ``max_points`` of them"""
+    snapshot = current_sim().snapshot()
+    resolution = request.args.get('resolution', 'raw')
+    max_points = request.args.get('max_points', type=int)
+    if max_points is not None:
+        max_points = max(3, max_points)
+    try:
+        return versioned_json(snapshot, ("price_history", region, commodity, resolution, max_points),
+                              lambda: snapshot.get_price_history(region, commodity, resolution, max_points))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/as_of/<int:day>')
+@app.route('/api/c/<campaign>/as_of/<int:day>')
+def get_as_of(day):
+    """API endpoint for every price at the end of a past market day, optionally for ``cells=Region:commodity,...``"""
+    sim = current_sim()
+    snapshot = sim.snapshot()
+    selectors = request.args.get('cells').split(',') if request.args.get('cells') else None
+
+    def compute():
+        prices = sim.as_of(day)
+        market = {}
+        for i, j in cells:
+            market.setdefault(snapshot.regions[i], {})[snapshot.commodity_names[j]] = float(prices[i, j])
+        return {"day": day, "seed": sim.seed, "market": market}
+
+    try:
+        cells = market_batch.parse_selectors(snapshot, selectors)
+        return versioned_json(snapshot, ("as_of", day, tuple(cells)), compute)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/archive/<region>/<commodity>')
+@app.route('/api/c/<campaign>/archive/<region>/<commodity>')
+def get_archived_prices(region, commodity):
+    """API endpoint for one cell's end-of-day prices over ``start``..``end``, recomputed from the archive.
+
+    With ``max_points`` the series is thinned by LTTB and ``days`` gives the day of each kept price.
+    """
+    sim = current_sim()
+    snapshot = sim.snapshot()
+    start = request.args.get('start', sim.archive.start_day, type=int)
+    end = request.args.get('end', snapshot.day, type=int)
+    max_points = request.args.get('max_points', type=int)
+    if end - start >= ARCHIVE_MAX_DAYS:
+        return jsonify({"error": f"At most {ARCHIVE_MAX_DAYS} days per request"}), 400
+
+    def compute():
+        result = {"region": region, "commodity": commodity, "start": start, "end": end, "seed": sim.seed,
+                  "prices": sim.price_series(region, commodity, start, end)}
+        if max_points is not None:
+            kept = lttb(result["prices"], max(3, max_points))
+            result.update(prices=[result["prices"][k] for k in kept.tolist()], days=(kept + start).tolist())
+        return result
+
+    try:
+        return versioned_json(snapshot, ("archive", region, commodity, start, end, max_points), compute)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/top_trades')
+@app.route('/api/c/<campaign>/top_trades')
+def get_top_trades():
+    """API endpoint for the best single trades across every pair of regions"""
+    snapshot = current_sim().snapshot()
+    k = max(1, min(request.args.get('k', 10, type=int), 1000))
+    return versioned_json(snapshot, ("top_trades", k), lambda: snapshot.calculate_top_trades(k))
+
+@app.route('/api/trade_routes')
+@app.route('/api/c/<campaign>/trade_routes')
+def get_trade_routes():
+    """API endpoint for the best multi-hop trade chains, with ``exact`` False where the search was approximate"""
+    snapshot = current_sim().snapshot()
+    start = request.args.get('start') or None
+    if start is not None and start not in snapshot.region_index:
+        return jsonify({"error": f"Unknown region: {start}"}), 400
+    hops = max(1, min(request.args.get('hops', 3, type=int), MAX_HOPS))
+    k = max(1, min(request.args.get('k', 10, type=int), 100))
+    cost = request.args.get('cost', DEFAULT_TRANSPORT_COST, type=float)
+    if not 0 <= cost < 1:
+        return jsonify({"error": "cost must be a fraction between 0 and 1"}), 400
+    return versioned_json(snapshot, ("trade_routes", start, hops, k, cost),
+                          lambda: snapshot.calculate_trade_routes(start, hops, k, cost))
+
+@app.route('/api/batch', methods=['GET', 'POST'])
+@app.route('/api/c/<campaign>/batch', methods=['GET', 'POST'])
+def get_batch():
+    """Price histories for many cells in one request, optionally only the points after a version or day.
+
+    GET takes ``cells=Region:commodity,...``; POST takes ``{"selectors": [[region, commodity], ...]}``.
+    Both take ``since``, ``since_day`` and ``format`` (rows or columnar). The response is
+    msgpack when the client accepts application/msgpack, and gzipped when it accepts gzip.
+    """
+    sim = current_sim()
+    snapshot = sim.snapshot()
+    params = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    selectors = params.get('selectors')
+    if selectors is None and request.args.get('cells'):
+        selectors = request.args.get('cells').split(',')
+    layout = params.get('format', request.args.get('format', 'rows'))
+    try:
+        since = params.get('since', request.args.get('since'))
+        since = int(since) if since is not None else None
+        since_day = params.get('since_day', request.args.get('since_day'))
+        since_day = int(since_day) if since_day is not None else None
+        if layout not in market_batch.FORMATS:
+            raise ValueError(f"format must be one of {', '.join(market_batch.FORMATS)}")
+        cells = market_batch.parse_selectors(snapshot, selectors)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    encoding = 'json'
+    if market_batch.msgpack is not None and request.accept_mimetypes.best_match(
+            ['application/json', 'application/msgpack']) == 'application/msgpack':
+        encoding = 'msgpack'
+    gzipped = 'gzip' in request.accept_encodings
+
+    def compute():
+        payload = market_batch.batch(snapshot, sim.deltas, cells, since, since_day, layout)
+        body = market_batch.encode(payload, encoding, MarketJSONProvider.default)
+        return market_batch.compress(body) if gzipped else body
+
+    key = ("batch", tuple(cells), since, since_day, layout, encoding, gzipped)
+    body = snapshot.result_cache.get_or_compute(snapshot.version, key, compute)
+    response = app.response_class(body, mimetype='application/msgpack' if encoding == 'msgpack' else 'application/json')
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+@app.route('/api/stream')
+@app.route('/api/c/<campaign>/stream')
+def stream():
+    """Server-Sent Events: the prices changed by every tick and event, resumable via Last-Event-ID"""
+    sim = current_sim()
+    snapshot = sim.snapshot()
+    try:
+        version = int(request.headers.get('Last-Event-ID') or request.args.get('since', snapshot.version))
+    except ValueError:
+        version = snapshot.version
+
+    def generate():
+        nonlocal version
+        yield "retry: 3000\n\n"
+        yield sse_message("world", {"version": snapshot.version, "regions": snapshot.regions,
+                                    "commodities": snapshot.commodity_names})
+        idle = 0.0
+        while True:
+            messages = sim.deltas.since(version)
+            if messages is None:
+                # Too far behind (or ahead, after a restart): the client must reload
+                version = sim.deltas.latest
+                yield sse_message("reset", {"version": version}, version)
+                continue
+            for version, message in messages:
+                yield message
+            if messages:
+                idle = 0.0
+            elif not sim.deltas.wait(version, STREAM_POLL_SECONDS):
+                # Pick up writes made by other worker processes, and keep proxies from timing out
+                sim.snapshot()
+                idle += STREAM_POLL_SECONDS
+                if idle >= STREAM_KEEPALIVE_SECONDS:
+                    idle = 0.0
+                    yield ": keepalive\n\n"
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/forecast', methods=['GET', 'POST'])
+@app.route('/api/c/<campaign>/forecast', methods=['GET', 'POST'])
+def forecast():
+    """Monte Carlo percentile bands for future prices, without touching the live market"""
+    snapshot = current_sim().snapshot()
+    params = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    if not isinstance(params, dict):
+        return jsonify({"error": "The request body must be a JSON object"}), 400
+    try:
+        days = int(params.get('days', request.args.get('days', 30)))
+        paths = int(params.get('paths', request.args.get('paths', 1000)))
+        seed = params.get('seed', request.args.get('seed'))
+        seed = int(seed) if seed is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "days, paths and seed must be integers"}), 400
+    if not 1 <= days <= 365 or not 1 <= paths <= 100000:
+        return jsonify({"error": "days must be 1-365 and paths 1-100000"}), 400
+
+    region = params.get('region', request.args.get('region'))
+    regions = params.get('regions') or ([region] if region else None)
+    events = params.get('events', [])
+
+    def compute():
+        return run_forecast(snapshot, days=days, paths=paths, seed=seed, events=events, regions=regions)
+
+    try:
+        if seed is None:
+            return jsonify(compute())
+        # Seeded forecasts are deterministic, so their JSON can be shared per market version
+        return versioned_json(snapshot, ("forecast", days, paths, seed, repr(events), repr(regions)), compute)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,287 @@
+"""Benchmarks for the market simulator and the Flask routes on synthetic worlds.
+
+    python benchmark.py                                  # shipped size and a medium world
+    python benchmark.py --sizes 8x15x30 1000x500x365 --output bench_output.json
+    python benchmark.py --compare bench_output.json      # ratios against an earlier run
+
+A size is REGIONSxCOMMODITIESxHISTORY_DAYS. Each world is written as a market
+snapshot with a random-walk history of that length, loaded, and then every
+operation is timed for ``--iterations`` runs or ``--max-seconds``, whichever comes
+first. Results are printed as a table on stderr and as JSON on stdout (or to
+``--output``), including latency percentiles, throughput and the peak memory
+allocated by one run of each operation. Alternating ticks and events must not
+compact the price history more than once per retention window of ticks; the run
+fails if they do.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from market_simulator import MarketSimulator
+from price_history import PriceHistory
+
+DEFAULT_SIZES = ("8x15x30", "100x50x90")
+UNITS = ("gp/lb", "sp/lb", "cp/lb", "sp/gallon")
+
+
+def parse_size(text):
+    regions, commodities, history_days = (int(part) for part in text.lower().split("x"))
+    return regions, commodities, history_days
+
+
+def synthetic_world(n_regions, n_commodities, seed=0):
+    """A world shaped like the built-in one: small regional modifiers and three events per region"""
+    rng = np.random.default_rng(seed)
+    commodities = {
+        f"commodity_{j}": {
+            "base_price": round(float(rng.lognormal(0, 1.5)), 4),
+            "unit": UNITS[j % len(UNITS)],
+            "volatility": round(float(rng.uniform(0.05, 0.3)), 3)
+        }
+        for j in range(n_commodities)
+    }
+    names = list(commodities)
+    region_modifiers = {}
+    events_by_region = {}
+    for i in range(n_regions):
+        region = f"Region {i}"
+        picked = rng.choice(names, size=min(6, len(names)), replace=False)
+        # Modifiers compound every tick, so keep them near zero like a long-running world would
+        region_modifiers[region] = {str(c): round(float(rng.uniform(-0.01, 0.01)), 4) for c in picked}
+        events_by_region[region] = [
+            {"description": f"Event {k} in {region}",
+             "effects": {str(c): round(float(rng.uniform(-0.2, 0.3)), 2)
+                         for c in rng.choice(names, size=min(3, len(names)), replace=False)}}
+            for k in range(3)
+        ]
+    return {"commodities": commodities, "region_modifiers": region_modifiers, "events_by_region": events_by_region}
+
+
+def write_synthetic_state(path, world, history_days, seed=0):
+    """Write a market snapshot whose every cell has ``history_days`` of random-walk prices.
+
+    Regions are generated and written one at a time so large worlds do not need the
+    whole history in memory at once.
+    """
+    rng = np.random.default_rng(seed)
+    names = list(world["commodities"])
+    base = np.array([world["commodities"][c]["base_price"] for c in names])
+    volatility = np.array([world["commodities"][c]["volatility"] for c in names])
+
+    with open(path, "w") as f:
+        f.write('{"market":{')
+        for i, region in enumerate(world["region_modifiers"]):
+            steps = rng.standard_normal((history_days, len(names))) * volatility * 0.5
+            walk = np.maximum(0.1 * base, base * np.exp(np.cumsum(steps, axis=0) - steps[0]))
+            cells = {c: {"current_price": float(walk[-1, j]), "history": walk[:, j].tolist()}
+                     for j, c in enumerate(names)}
+            f.write(("," if i else "") + json.dumps(region) + ":" + json.dumps(cells, separators=(",", ":")))
+        f.write('},"last_events":{},"event_history":[],"seq":0,"day":%d}' % (history_days - 1))
+
+
+def measure(operation, iterations, max_seconds, setup=None):
+    """Time ``operation`` repeatedly, then run it once more under tracemalloc for its peak allocation"""
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < iterations and (len(samples) < 3 or time.perf_counter() - started < max_seconds):
+        if setup:
+            setup()
+        t0 = time.perf_counter_ns()
+        operation()
+        samples.append(time.perf_counter_ns() - t0)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ms = np.array(samples) / 1e6
+    return {
+        "iterations": len(samples),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "ops_per_second": float(1000 / ms.mean()) if ms.mean() else None,
+        "peak_alloc_bytes": int(peak)
+    }
+
+
+def benchmark_size(size, workdir, args):
+    n_regions, n_commodities, history_days = size
+    world = synthetic_world(n_regions, n_commodities, seed=args.seed)
+    market_file = os.path.join(workdir, f"market_{n_regions}x{n_commodities}x{history_days}.json")
+    write_synthetic_state(market_file, world, history_days, seed=args.seed)
+    regions = list(world["region_modifiers"])
+    commodities = list(world["commodities"])
+    results = {}
+
+    def run(name, operation, setup=None, iterations=args.iterations):
+        results[name] = measure(operation, iterations, args.max_seconds, setup)
+        print(f"  {name:<40} p50 {results[name]['p50_ms']:>10.3f} ms   p99 {results[name]['p99_ms']:>10.3f} ms",
+              file=sys.stderr)
+
+    def load():
+        return MarketSimulator(seed=args.seed, market_file=market_file, history_days=history_days, world=world)
+
+    run("load_market", load, iterations=min(args.iterations, 5))
+    sim = load()
+
+    def clear_cache():
+        sim.result_cache.clear()
+        sim.fragments.clear()
+
+    run("update_prices", sim.update_prices)
+    run("advance_days(7)", lambda: sim.advance_days(7))
+    run("trigger_event", lambda: sim.trigger_event(regions[0], 0))
+    run("trigger_events (one per region)",
+        lambda: sim.trigger_events([{"region": region, "event_index": 0} for region in regions]))
+    run("trigger_event (scheduled, decaying)",
+        lambda: sim.trigger_event(regions[0], 1, in_days=3, duration=10, decay=0.8))
+
+    # Count history compactions over tick/event pairs: events revise in place, so only ticks fill rows
+    compactions = 0
+    compact = PriceHistory._compact
+
+    def counting_compact(history):
+        nonlocal compactions
+        compactions += 1
+        compact(history)
+
+    def tick_and_event():
+        sim.update_prices()
+        sim.trigger_event(regions[0], 0)
+
+    PriceHistory._compact = counting_compact
+    try:
+        run("update_prices + trigger_event", tick_and_event)
+        pairs = results["update_prices + trigger_event"]["iterations"] + 1
+    finally:
+        PriceHistory._compact = compact
+    results["update_prices + trigger_event"]["compactions"] = compactions
+    assert compactions <= pairs // sim.history.capacity + 1, (compactions, pairs)
+
+    run("as_of (mid-interval)", lambda: sim.as_of(sim.day - sim.archive.interval // 2))
+    run("calculate_volatility_analysis", sim.calculate_volatility_analysis, setup=clear_cache)
+    run("calculate_trend_analysis", sim.calculate_trend_analysis, setup=clear_cache)
+    run("calculate_regional_performance", sim.calculate_regional_performance, setup=clear_cache)
+    run("calculate_profit_opportunities",
+        lambda: sim.calculate_profit_opportunities(regions[0], regions[-1]), setup=clear_cache)
+    run("calculate_volatility_analysis (cached)", sim.calculate_volatility_analysis)
+    run("save_market", sim.save_market, iterations=min(args.iterations, 5))
+
+    if not args.skip_routes:
+        import app as app_module
+        app_module.market_sim = sim
+        client = app_module.app.test_client()
+        region, commodity = regions[0], commodities[0]
+        routes = {
+            "GET /": "/",
+            "GET /regions": f"/regions?export={regions[0]}&import={regions[-1]}",
+            "GET /charts": f"/charts?region={region}&commodity={commodity}",
+            "GET /events": "/events",
+            "GET /analytics": "/analytics",
+            "GET /api/market_data/all": "/api/market_data/all",
+            "GET /api/price_history": f"/api/price_history/{region}/{commodity}",
+            "GET /api/batch (columnar)": "/api/batch?format=columnar",
+        }
+        for name, url in routes.items():
+            def get(url=url):
+                response = client.get(url)
+                assert response.status_code == 200, (url, response.status_code)
+            run(name, get, setup=clear_cache, iterations=min(args.iterations, 10))
+        run("GET / (fragments cached)", lambda: client.get("/"), setup=sim.result_cache.clear)
+        run("POST /api/advance_day", lambda: client.post("/api/advance_day", headers={"Accept": "application/json"}))
+
+    return {
+        "regions": n_regions,
+        "commodities": n_commodities,
+        "history_days": history_days,
+        "operations": results,
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def compare(current, baseline_path):
+    """Print the p50 ratio of every operation against an earlier results file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r["regions"], r["commodities"], r["history_days"]): r["operations"] for r in baseline["results"]}
+    print(f"\nRatio of p50 latency against {baseline_path} (commit {baseline['environment'].get('commit')}):",
+          file=sys.stderr)
+    for result in current["results"]:
+        key = (result["regions"], result["commodities"], result["history_days"])
+        if key not in before:
+            continue
+        print("  %dx%dx%d" % key, file=sys.stderr)
+        for name, stats in result["operations"].items():
+            if name in before[key] and before[key][name]["p50_ms"]:
+                ratio = stats["p50_ms"] / before[key][name]["p50_ms"]
+                flag = "  <-- slower" if ratio > 1.2 else ""
+                print(f"    {name:<40} {ratio:6.2f}x{flag}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="REGIONSxCOMMODITIESxDAYS, e.g. 8x15x30")
+    parser.add_argument("--iterations", type=int, default=20, help="maximum timed runs per operation")
+    parser.add_argument("--max-seconds", type=float, default=2.0, help="time budget per operation (at least 3 runs)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-routes", action="store_true", help="only benchmark the simulator")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    report = {"environment": environment(), "results": []}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # Importing app creates its default market in the working directory; keep it out of the repo
+        os.chdir(workdir)
+        try:
+            for text in args.sizes:
+                print(f"{text}:", file=sys.stderr)
+                report["results"].append(benchmark_size(parse_size(text), workdir, args))
+        finally:
+            os.chdir(cwd)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
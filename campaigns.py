@@ -0,0 +1,118 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from market_simulator import MarketSimulator
+
+CAMPAIGN_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class CampaignRegistry:
+    """MarketSimulators for many campaigns, loaded on first use and evicted when idle.
+
+    Each campaign keeps its state under ``<root>/<campaign>/``, where a ``world.json``
+    replaces the shared world definition for that campaign. Nothing is read at
+    start-up; a campaign is loaded the first time it is requested and kept hot until
+    it falls out of the LRU order, goes over the memory budget or sits idle. Evicted
+    campaigns are flushed to a fresh snapshot so the next load is a single read.
+    Only an explicit ``create`` starts a campaign that has no directory yet.
+    """
+
+    def __init__(self, root="campaigns", max_loaded=16, memory_budget=256 * 1024 * 1024,
+                 idle_seconds=None, **sim_options):
+        self.root = root
+        self.max_loaded = max_loaded
+        self.memory_budget = memory_budget
+        self.idle_seconds = idle_seconds
+        self.sim_options = sim_options
+        self._loaded = OrderedDict()    # campaign -> (simulator, last access time)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def is_valid(self, campaign):
+        return bool(CAMPAIGN_ID.match(campaign))
+
+    def exists(self, campaign):
+        return self.is_valid(campaign) and os.path.isdir(os.path.join(self.root, campaign))
+
+    def get(self, campaign, create=False):
+        """Return the campaign's simulator, loading it from disk if it is not in memory.
+
+        Raises KeyError for an invalid id, or for a campaign that does not exist yet
+        unless ``create`` is set.
+        """
+        if not self.is_valid(campaign):
+            raise KeyError(campaign)
+
+        with self._lock:
+            if campaign in self._loaded:
+                sim = self._loaded[campaign][0]
+                self._loaded[campaign] = (sim, time.monotonic())
+                self._loaded.move_to_end(campaign)
+                return sim
+            if not create and not self.exists(campaign):
+                raise KeyError(campaign)
+            load_lock = self._load_locks.setdefault(campaign, threading.Lock())
+
+        # Load outside the registry lock so other campaigns are not held up
+        with load_lock:
+            with self._lock:
+                if campaign in self._loaded:
+                    return self._loaded[campaign][0]
+            directory = os.path.join(self.root, campaign)
+            os.makedirs(directory, exist_ok=True)
+            options = dict(self.sim_options)
+            if os.path.exists(os.path.join(directory, "world.json")):
+                # A campaign may bring its own world instead of the shared one
+                options["world"] = os.path.join(directory, "world.json")
+            sim = MarketSimulator(market_file=os.path.join(directory, "market_state.json"), **options)
+
+            with self._lock:
+                self._loaded[campaign] = (sim, time.monotonic())
+                self._load_locks.pop(campaign, None)
+                evicted = self._select_evictions(keep=campaign)
+
+        for old_sim in evicted:
+            old_sim.save_market()
+        return sim
+
+    def loaded(self):
+        """Campaign ids currently held in memory, least recently used first"""
+        with self._lock:
+            return list(self._loaded)
+
+    def memory_usage(self):
+        with self._lock:
+            return sum(sim.memory_usage() for sim, _ in self._loaded.values())
+
+    def evict_idle(self):
+        """Flush and drop campaigns that have not been used for ``idle_seconds``"""
+        with self._lock:
+            evicted = self._select_evictions()
+        for sim in evicted:
+            sim.save_market()
+
+    def flush_all(self):
+        """Snapshot every loaded campaign"""
+        with self._lock:
+            sims = [sim for sim, _ in self._loaded.values()]
+        for sim in sims:
+            sim.save_market()
+
+    def _select_evictions(self, keep=None):
+        """Pop campaigns past the count, memory or idle limits, least recently used first"""
+        evicted = []
+        now = time.monotonic()
+        usage = sum(sim.memory_usage() for sim, _ in self._loaded.values())
+        for campaign in list(self._loaded):
+            if campaign == keep:
+                continue
+            sim, last_used = self._loaded[campaign]
+            idle = self.idle_seconds is not None and now - last_used > self.idle_seconds
+            if len(self._loaded) > self.max_loaded or usage > self.memory_budget or idle:
+                del self._loaded[campaign]
+                usage -= sim.memory_usage()
+                evicted.append(sim)
+        return evicted
@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from market_events import MAX_EFFECT_DAYS, EventQueue
+from metrics import timed
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# Most simulated cell-days one forecast may draw: paths x days x cells of the chosen regions
+# (10,000 paths over 30 days of the shipped 8 x 15 world is 36 million)
+MAX_FORECAST_SAMPLES = 50_000_000
+
+# Cells are simulated in blocks of this many commodities per region. The block layout
+# (and so each block's random stream) depends only on the world, never on the pool size.
+BLOCK_SIZE = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor(workers):
+    """Shared process pool, started on first use.
+
+    Workers are forked where possible: they only ever run _simulate_block, and
+    forking avoids re-importing the app (and loading a market) in every worker.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _simulate_block(prices, volatilities, floors, modifiers, factors, schedule, days, paths, seed, percentiles):
+    """Percentile bands for one block of cells over ``paths`` simulated futures.
+
+    Moves prices day by day as MarketSimulator._tick_prices does, with every path
+    drawn at once: the random move, then that day's ``factors`` from fading event
+    effects, then the block's events due that day.
+    """
+    rng = np.random.default_rng(seed)
+    current = np.broadcast_to(prices, (paths, len(prices))).copy()
+    bands = np.empty((len(percentiles), days, len(prices)))
+
+    for day in range(days):
+        shocks = rng.standard_normal(current.shape) * volatilities
+        current = np.maximum(floors, current + shocks * current) * modifiers
+        if day + 1 in factors:
+            current = np.maximum(floors, current * factors[day + 1])
+        for cols, changes in schedule.get(day + 1, ()):
+            current[:, cols] = np.maximum(floors[cols], current[:, cols] * (1 + changes))
+        bands[:, day, :] = np.percentile(current, percentiles, axis=0)
+
+    return bands
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+@timed("forecast")
+def run_forecast(snapshot, days=30, paths=1000, seed=None, events=(), regions=None,
+                 percentiles=PERCENTILES, workers=None):
+    """Monte Carlo price bands for ``days`` ahead, starting from a market snapshot.
+
+    The market's scheduled events and still-fading effects play out as they would
+    live. ``events`` add what-if events on top, as ``{"day": 1..days, "region": ...,
+    "event_index": ...}`` with an optional ``duration`` and ``decay`` as for
+    trigger_events. The live market is never touched. The same seed always gives the
+    same bands, whatever the number of worker processes.
+    """
+    if regions and (not isinstance(regions, (list, tuple)) or not all(isinstance(region, str) for region in regions)):
+        raise ValueError("regions must be a list of region names")
+    if not isinstance(events, (list, tuple)) or not all(isinstance(event, dict) for event in events):
+        raise ValueError("events must be a list of event objects")
+    regions = list(regions) if regions else list(snapshot.regions)
+    for region in regions:
+        if region not in snapshot.region_index:
+            raise ValueError(f"Unknown region: {region}")
+    if paths * days * len(regions) * len(snapshot.commodity_names) > MAX_FORECAST_SAMPLES:
+        raise ValueError(f"paths x days x forecast cells must be at most {MAX_FORECAST_SAMPLES:,}; "
+                         f"ask for fewer paths, days or regions")
+
+    queue = EventQueue(snapshot.world)
+    queue.load(snapshot.scheduled_events, snapshot.active_events)
+    for event in events:
+        region, day, index = event.get("region"), event.get("day"), event.get("event_index")
+        if not isinstance(region, str) or region not in snapshot.region_index:
+            raise ValueError(f"Unknown region: {region}")
+        if not _is_int(day) or not 1 <= day <= days:
+            raise ValueError(f"Event day must be between 1 and {days}")
+        i = snapshot.region_index[region]
+        if not _is_int(index) or not 0 <= index < snapshot.world.event_count(i):
+            raise ValueError(f"Invalid event index for {region}: {index}")
+        duration, decay = event.get("duration"), event.get("decay", 1.0)
+        if duration is not None and (not _is_int(duration) or not 1 <= duration <= MAX_EFFECT_DAYS):
+            raise ValueError(f"Event duration must be between 1 and {MAX_EFFECT_DAYS} days")
+        if isinstance(decay, bool) or not isinstance(decay, (int, float)) or not 0 <= decay <= 1:
+            raise ValueError("Event decay must be between 0 and 1")
+        _, cols, changes = snapshot.world.event(i, index)
+        queue.schedule({"day": snapshot.day + day, "region": region, "duration": duration, "decay": decay,
+                        "effects": {snapshot.commodity_names[j]: change
+                                    for j, change in zip(cols.tolist(), changes.tolist())}})
+
+    # Play the queue forward: per region row, the effects' daily factors and the events due each day
+    factors, schedule = {}, {}
+    for k in range(1, days + 1):
+        day = snapshot.day + k
+        day_factors = queue.factors(day)
+        if day_factors is not None:
+            for i in np.flatnonzero((day_factors != 1).any(axis=1)).tolist():
+                factors.setdefault(i, {})[k] = day_factors[i]
+        queue.expire(day)
+        for record in queue.due(day):
+            i, cols, changes = queue.resolve(record)
+            queue.activate(record, i, cols, changes)
+            schedule.setdefault(i, {}).setdefault(k, []).append((cols, changes))
+
+    seed_sequence = np.random.SeedSequence(seed)
+    n_commodities = len(snapshot.commodity_names)
+    blocks = [(i, start) for i in range(len(snapshot.regions)) for start in range(0, n_commodities, BLOCK_SIZE)]
+    block_seeds = dict(zip(blocks, seed_sequence.spawn(len(blocks))))
+
+    tasks = []
+    for region in regions:
+        i = snapshot.region_index[region]
+        for start in range(0, n_commodities, BLOCK_SIZE):
+            stop = min(start + BLOCK_SIZE, n_commodities)
+            block_factors = {day: row[start:stop] for day, row in factors.get(i, {}).items()
+                             if (row[start:stop] != 1).any()}
+            block_schedule = {}
+            for day, day_effects in schedule.get(i, {}).items():
+                for cols, changes in day_effects:
+                    inside = (cols >= start) & (cols < stop)
+                    if inside.any():
+                        block_schedule.setdefault(day, []).append((cols[inside] - start, changes[inside]))
+            tasks.append((region, start, (
+                snapshot.prices[i, start:stop], snapshot.volatilities[start:stop], snapshot.price_floors[start:stop],
+                snapshot.modifier_matrix[i, start:stop], block_factors, block_schedule, days, paths,
+                block_seeds[(i, start)], list(percentiles)
+            )))
+
+    workers = workers or int(os.environ.get("FORECAST_WORKERS", os.cpu_count() or 1))
+    if workers == 1 or len(tasks) == 1:
+        results = [_simulate_block(*args) for _, _, args in tasks]
+    else:
+        pool = _executor(workers)
+        results = list(pool.map(_simulate_block, *zip(*(args for _, _, args in tasks))))
+
+    bands = {}
+    for (region, start, _), block in zip(tasks, results):
+        region_bands = bands.setdefault(region, {})
+        for offset in range(block.shape[2]):
+            commodity = snapshot.commodity_names[start + offset]
+            region_bands[commodity] = {f"p{p:g}": block[k, :, offset].tolist() for k, p in enumerate(percentiles)}
+
+    return {
+        "version": snapshot.version,
+        "days": days,
+        "paths": paths,
+        "seed": seed_sequence.entropy,
+        "percentiles": list(percentiles),
+        "bands": bands
+    }
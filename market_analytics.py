@@ -0,0 +1,191 @@
+import math
+
+import numpy as np
+
+# Number of most recent history points the analytics look at
+ANALYTICS_WINDOW = 30
+
+
+class RunningAnalytics:
+    """Rolling market statistics updated as each tick or event is applied.
+
+    Keeps, per cell, a ring of the absolute day-over-day returns inside the
+    analytics window with their running sum, plus the latest 1-day and 7-day
+    changes; per region it keeps the market value and the sum of 1-day changes.
+    The running return sums are re-summed exactly once per window of ticks so
+    floating point drift cannot build up.
+    """
+
+    def __init__(self, history, window=ANALYTICS_WINDOW):
+        self.history = history
+        self.window = max(2, min(window, history.capacity))
+        shape = history.lengths.shape
+        self._returns = np.zeros(shape + (self.window - 1,))
+        self._return_head = np.zeros(shape, dtype=np.intp)
+        self.return_count = np.zeros(shape, dtype=np.intp)
+        self.abs_return_sum = np.zeros(shape)
+        self.day_change = np.zeros(shape)
+        self.week_change = np.zeros(shape)
+        self.region_value = np.zeros(shape[0])
+        self.region_change_sum = np.zeros(shape[0])
+        self.region_change_count = np.zeros(shape[0], dtype=np.intp)
+        self._ticks_since_resum = 0
+        self.rebuild()
+
+    def rebuild(self):
+        """Recompute every statistic from the stored history"""
+        values, filled = self.history.window(self.window)
+        valid = filled[..., 1:] & filled[..., :-1]
+        previous = np.where(valid, values[..., :-1], 1.0)
+        returns = np.where(valid, np.abs((values[..., 1:] - values[..., :-1]) / previous), 0.0)
+
+        self._returns[...] = returns
+        self.return_count[...] = valid.sum(axis=2)
+        self._return_head[...] = 0
+        self.abs_return_sum[...] = np.cumsum(returns, axis=2)[..., -1]
+        self._ticks_since_resum = 0
+        self._update_changes(None, None)
+        self._update_regions(np.arange(len(self.region_value)))
+
+    def observe(self, rows=None, cols=None):
+        """Fold in the value just appended to every cell, or to the cells at (rows, cols)"""
+        is_tick = rows is None
+        if is_tick:
+            lengths = self.history.lengths
+            regions = np.arange(len(self.region_value))
+        else:
+            regions = np.unique(rows)
+            lengths = self.history.lengths[rows, cols]
+        latest = self.history.last(1, rows, cols)
+        previous = self.history.last(2, rows, cols)
+        has_previous = lengths >= 2
+        returns = np.abs((latest - previous) / np.where(has_previous, previous, 1.0))
+
+        if is_tick:
+            rows, cols = np.nonzero(has_previous)
+        else:
+            rows, cols = np.asarray(rows)[has_previous], np.asarray(cols)[has_previous]
+        returns = returns[has_previous]
+
+        head = self._return_head[rows, cols]
+        full = self.return_count[rows, cols] == self._returns.shape[2]
+        evicted = np.where(full, self._returns[rows, cols, head], 0.0)
+        self.abs_return_sum[rows, cols] += returns - evicted
+        self._returns[rows, cols, head] = returns
+        self._return_head[rows, cols] = (head + 1) % self._returns.shape[2]
+        self.return_count[rows, cols] += ~full
+
+        self._update_changes(rows, cols)
+        self._update_regions(regions)
+
+        if is_tick:
+            self._ticks_since_resum += 1
+            if self._ticks_since_resum >= self._returns.shape[2]:
+                self._resum()
+
+    def revise(self, rows, cols):
+        """Fold in a revision of the last value of the (distinct) cells at (rows, cols)"""
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        regions = np.unique(rows)
+        has_previous = self.history.lengths[rows, cols] >= 2
+        rows, cols = rows[has_previous], cols[has_previous]
+        latest = self.history.last(1, rows, cols)
+        previous = self.history.last(2, rows, cols)
+        returns = np.abs((latest - previous) / previous)
+
+        # The cell's newest return is the one just before the ring's head
+        head = (self._return_head[rows, cols] - 1) % self._returns.shape[2]
+        self.abs_return_sum[rows, cols] += returns - self._returns[rows, cols, head]
+        self._returns[rows, cols, head] = returns
+
+        self._update_changes(rows, cols)
+        self._update_regions(regions)
+
+    def volatility(self):
+        """Mean absolute day-over-day return of every cell over the window"""
+        return np.divide(self.abs_return_sum, self.return_count,
+                         out=np.zeros_like(self.abs_return_sum), where=self.return_count > 0)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self._returns, self._return_head, self.return_count,
+                                              self.abs_return_sum, self.day_change, self.week_change))
+
+    def freeze(self):
+        """Copy of the figures the analytics pages read, unaffected by later ticks"""
+        return AnalyticsSnapshot(self)
+
+    def _resum(self):
+        """Re-add each cell's returns oldest first, exactly as a full rescan would"""
+        n = self._returns.shape[2]
+        order = (self._return_head[..., np.newaxis] + np.arange(n)) % n
+        chronological = np.take_along_axis(self._returns, order, axis=2)
+        self.abs_return_sum[...] = np.cumsum(chronological, axis=2)[..., -1]
+        self._ticks_since_resum = 0
+
+    def _update_changes(self, rows, cols):
+        if rows is None:
+            lengths = self.history.lengths
+        else:
+            lengths = self.history.lengths[rows, cols]
+        latest = self.history.last(1, rows, cols)
+        day_ago = self.history.last(2, rows, cols)
+        week_ago = self.history.last(7, rows, cols)
+        day_change = np.where(lengths >= 2, (latest - day_ago) / np.where(lengths >= 2, day_ago, 1.0), 0.0)
+        week_change = np.where(lengths >= 7, (latest - week_ago) / np.where(lengths >= 7, week_ago, 1.0), day_change)
+
+        if rows is None:
+            self.day_change[...] = day_change
+            self.week_change[...] = week_change
+        else:
+            self.day_change[rows, cols] = day_change
+            self.week_change[rows, cols] = week_change
+
+    def _update_regions(self, regions):
+        if len(regions) == 0:
+            return
+        # cumsum adds left to right, matching a plain running total
+        prices = self.history.last(1)[regions]
+        has_change = self.history.lengths[regions] >= 2
+        self.region_value[regions] = np.cumsum(prices, axis=1)[:, -1]
+        self.region_change_sum[regions] = np.cumsum(np.where(has_change, self.day_change[regions], 0.0), axis=1)[:, -1]
+        self.region_change_count[regions] = has_change.sum(axis=1)
+
+
+class AnalyticsSnapshot:
+    """Immutable copy of the running analytics as of one market version"""
+
+    __slots__ = ("window", "volatility", "return_count", "day_change", "week_change",
+                 "region_value", "region_change_sum", "region_change_count")
+
+    def __init__(self, analytics):
+        self.window = analytics.window
+        self.volatility = analytics.volatility()
+        self.return_count = analytics.return_count.copy()
+        self.day_change = analytics.day_change.copy()
+        self.week_change = analytics.week_change.copy()
+        self.region_value = analytics.region_value.copy()
+        self.region_change_sum = analytics.region_change_sum.copy()
+        self.region_change_count = analytics.region_change_count.copy()
+
+
+def ordered_sum(values):
+    """Sum values left to right, as a Python for loop would"""
+    return float(np.cumsum(values)[-1]) if len(values) else 0.0
+
+
+def assert_analytics_match(name, incremental, full, rel_tol=1e-9):
+    """Raise AssertionError if incrementally maintained analytics drift from a full recompute"""
+    def compare(a, b, path):
+        if isinstance(b, dict):
+            if set(a) != set(b):
+                raise AssertionError(f"{name}{path}: keys differ")
+            for key in b:
+                compare(a[key], b[key], f"{path}[{key!r}]")
+        elif isinstance(b, float) or isinstance(a, float):
+            if not math.isclose(a, b, rel_tol=rel_tol, abs_tol=1e-12):
+                raise AssertionError(f"{name}{path}: incremental {a!r} != recomputed {b!r}")
+        elif a != b:
+            raise AssertionError(f"{name}{path}: incremental {a!r} != recomputed {b!r}")
+
+    compare(incremental, full, "")
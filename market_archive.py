@@ -0,0 +1,211 @@
+import bisect
+import json
+import os
+import threading
+
+import numpy as np
+
+from market_store import _atomic_write
+from metrics import PERSISTED_BYTES
+
+# Days between full-market checkpoints; a point-in-time query replays at most this many days
+CHECKPOINT_DAYS = 30
+
+
+class MarketArchive:
+    """Every past market day, kept as sparse checkpoints plus the events applied between them.
+
+    Ticks are drawn from a random stream keyed by the market's seed and the day, so
+    any day can be recomputed from the prices before it. The archive stores the
+    prices of every cell right after the tick of every ``interval``-th day in
+    ``<name>.checkpoints`` (fixed-size records: the day as int64, then the prices as
+    float64) and every applied event, in order, in ``<name>.events.log``. The seed
+    and the day the archive starts on live in ``<name>.archive.json``.
+
+    Restoring a day reads the nearest checkpoint at or before it and replays the
+    ticks and events up to it, including the fading effects of events applied
+    before the checkpoint, so lookups cost at most ``interval`` days of simulation
+    however long the campaign has run, and storage is one market's prices per
+    ``interval`` days.
+    """
+
+    def __init__(self, snapshot_file, shape, interval=CHECKPOINT_DAYS):
+        base = os.path.splitext(snapshot_file)[0]
+        self.meta_file = base + ".archive.json"
+        self.checkpoint_file = base + ".checkpoints"
+        self.event_file = base + ".events.log"
+        self.shape = tuple(shape)
+        self.interval = interval
+        self.record_size = 8 + 8 * int(np.prod(self.shape))
+        self.seed = None
+        self.start_day = 0
+        self._days = []         # day of each checkpoint record, in file order
+        self._events = []       # (day, seq, record, end offset) in the order they were applied
+        self._event_offset = 0
+        self._lock = threading.Lock()
+
+    def open(self, seed, day, prices, seq, layout=None):
+        """Open the archive for a market at ``day`` with ``prices`` and log sequence ``seq``.
+
+        Must be called under the store lock. An existing archive keeps its seed and
+        drops anything written past the market's state by a writer that crashed
+        before logging it; an archive for another world shape or ``layout`` (the
+        region and commodity names), or one ahead of the market, is started over
+        with ``seed`` (or a fresh random seed) at ``day``.
+        """
+        meta = None
+        try:
+            with open(self.meta_file, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        if (meta is not None and tuple(meta.get("shape", ())) == self.shape and meta.get("layout", layout) == layout
+                and meta.get("start_day", 0) <= day):
+            self.seed = meta["seed"]
+            self.start_day = meta["start_day"]
+            self._refresh()
+            self._truncate(day, seq)
+            if self._days:
+                return self.seed
+
+        # A new archive starts with a checkpoint of the market as it stands
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy)
+        self.start_day = day
+        self._days, self._events, self._event_offset = [], [], 0
+        for path in (self.checkpoint_file, self.event_file):
+            _atomic_write(path, "")
+        _atomic_write(self.meta_file, json.dumps({"seed": self.seed, "start_day": day, "shape": list(self.shape),
+                                                  "layout": layout}))
+        self._write_checkpoints([day], prices[np.newaxis])
+        return self.seed
+
+    def record_ticks(self, first_day, path):
+        """Checkpoint the days of a simulated days x regions x commodities block that fall on the interval"""
+        days = np.arange(first_day, first_day + len(path))
+        due = np.flatnonzero(days % self.interval == 0)
+        if len(due):
+            self._write_checkpoints(days[due].tolist(), path[due])
+
+    def record_events(self, entries):
+        """Journal ``(day, seq, event record)`` entries for events about to be logged, with one fsync"""
+        if not entries:
+            return
+        lines = []
+        for day, seq, event_record in entries:
+            record = {"day": day, "seq": seq, "region": event_record["region"], "effects": event_record["effects"]}
+            if event_record.get("duration"):
+                record.update(duration=event_record["duration"], decay=event_record.get("decay", 1.0))
+            if event_record.get("scheduled"):
+                record["scheduled"] = True
+            lines.append((record, (json.dumps(record, separators=(",", ":")) + "\n").encode()))
+        data = b"".join(line for _, line in lines)
+        with self._lock:
+            self._refresh()
+            with open(self.event_file, 'r+b') as f:
+                f.seek(self._event_offset)
+                f.write(data)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            PERSISTED_BYTES.inc(len(data), "events")
+            for record, line in lines:
+                self._event_offset += len(line)
+                self._events.append((record["day"], record["seq"], record, self._event_offset))
+
+    def checkpoint(self, day):
+        """The latest checkpoint at or before ``day`` as (checkpoint day, prices)"""
+        with self._lock:
+            self._refresh()
+            index = bisect.bisect_right(self._days, day) - 1
+            if index < 0:
+                raise ValueError(f"The archive starts on day {self.start_day}")
+            checkpoint_day = self._days[index]
+        with open(self.checkpoint_file, 'rb') as f:
+            f.seek(index * self.record_size + 8)
+            prices = np.fromfile(f, dtype='<f8', count=int(np.prod(self.shape)))
+        return checkpoint_day, prices.reshape(self.shape).astype(float)
+
+    def events(self, first_day, last_day):
+        """Records of the events applied from ``first_day`` through ``last_day``, in order"""
+        with self._lock:
+            self._refresh()
+            days = [event[0] for event in self._events]
+            start = bisect.bisect_left(days, first_day)
+            stop = bisect.bisect_right(days, last_day)
+            return [record for _, _, record, _ in self._events[start:stop]]
+
+    @property
+    def nbytes(self):
+        """Bytes the archive takes on disk"""
+        total = 0
+        for path in (self.meta_file, self.checkpoint_file, self.event_file):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def _write_checkpoints(self, days, prices):
+        data = b"".join(np.int64(day).astype('<i8').tobytes() + np.ascontiguousarray(day_prices, dtype='<f8').tobytes()
+                        for day, day_prices in zip(days, prices))
+        with self._lock:
+            self._refresh()
+            # Rewrite any checkpoint for a day being simulated again after a crash
+            keep = bisect.bisect_left(self._days, days[0])
+            with open(self.checkpoint_file, 'r+b') as f:
+                f.seek(keep * self.record_size)
+                f.write(data)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            PERSISTED_BYTES.inc(len(data), "checkpoints")
+            self._days[keep:] = days
+
+    def _refresh(self):
+        """Pick up checkpoints and events other processes have written since we last looked"""
+        try:
+            count = os.path.getsize(self.checkpoint_file) // self.record_size
+        except OSError:
+            count = 0
+        if count < len(self._days):
+            del self._days[count:]
+        elif count > len(self._days):
+            with open(self.checkpoint_file, 'rb') as f:
+                for index in range(len(self._days), count):
+                    f.seek(index * self.record_size)
+                    self._days.append(int(np.frombuffer(f.read(8), dtype='<i8')[0]))
+
+        try:
+            size = os.path.getsize(self.event_file)
+        except OSError:
+            size = 0
+        if size < self._event_offset:
+            self._events, self._event_offset = [], 0
+        if size > self._event_offset:
+            with open(self.event_file, 'rb') as f:
+                f.seek(self._event_offset)
+                for line in f:
+                    # A line without its newline is a write torn by a crash
+                    if not line.endswith(b"\n"):
+                        break
+                    record = json.loads(line)
+                    self._event_offset += len(line)
+                    self._events.append((record["day"], record["seq"], record, self._event_offset))
+
+    def _truncate(self, day, seq):
+        """Drop checkpoints past ``day`` and events past log sequence ``seq``"""
+        keep_days = bisect.bisect_right(self._days, day)
+        keep_events = len(self._events)
+        while keep_events and self._events[keep_events - 1][1] > seq:
+            keep_events -= 1
+        event_bytes = self._events[keep_events - 1][3] if keep_events else 0
+
+        for path, size in ((self.checkpoint_file, keep_days * self.record_size), (self.event_file, event_bytes)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+                    os.fsync(f.fileno())
+        del self._days[keep_days:]
+        del self._events[keep_events:]
+        self._event_offset = event_bytes
@@ -0,0 +1,122 @@
+import gzip
+import json
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # optional: without it only JSON is offered
+    msgpack = None
+
+FORMATS = ("rows", "columnar")
+
+
+def parse_selectors(snapshot, selectors):
+    """Cell indices for ``[region, commodity]`` pairs, where "*" matches every region or commodity.
+
+    No selectors means every cell. Raises ValueError for unknown names.
+    """
+    if not selectors:
+        selectors = [("*", "*")]
+
+    cells = []
+    for selector in selectors:
+        if isinstance(selector, dict):
+            region, commodity = selector.get("region", "*"), selector.get("commodity", "*")
+        elif isinstance(selector, str):
+            region, _, commodity = selector.partition(":")
+            commodity = commodity or "*"
+        else:
+            region, commodity = selector
+        if region != "*" and region not in snapshot.region_index:
+            raise ValueError(f"Unknown region: {region}")
+        if commodity != "*" and commodity not in snapshot.commodity_index:
+            raise ValueError(f"Unknown commodity: {commodity}")
+        rows = range(len(snapshot.regions)) if region == "*" else [snapshot.region_index[region]]
+        cols = range(len(snapshot.commodity_names)) if commodity == "*" else [snapshot.commodity_index[commodity]]
+        cells.extend((i, j) for i in rows for j in cols)
+    return list(dict.fromkeys(cells))
+
+
+def new_point_counts(snapshot, deltas, since):
+    """How many history points of each cell are new or revised after version ``since``, and which
+    cells had the last point they had at ``since`` revised; None if unknown.
+
+    Every tick adds a point to every cell, and an event revises the last point of the
+    cells it moved, so the counts follow from the delta journal without touching the
+    history itself. Only events before the first tick revise a point a client already has.
+    """
+    entries = deltas.entries(since, snapshot.version)
+    if entries is None:
+        return None
+    revised = np.zeros(snapshot.prices.shape, dtype=bool)
+    ticks = 0
+    for _, event, data in entries:
+        if event == "tick":
+            ticks += 1
+        elif event == "event" and not ticks:
+            i = snapshot.region_index[data["region"]]
+            revised[i, [snapshot.commodity_index[c] for c in data["prices"]]] = True
+    return revised + ticks, revised
+
+
+def batch(snapshot, deltas, cells, since=None, since_day=None, layout="rows"):
+    """History points for ``cells`` added after version ``since`` (or market day ``since_day``).
+
+    When the journal no longer covers the requested point the whole retained history
+    is returned and ``full`` is true. Otherwise a cell marked ``revised`` starts with a
+    new value for the last point the client already had. ``rows`` nests per-cell dicts
+    shaped like /api/market_data; ``columnar`` names each cell by its indices into
+    ``regions`` and ``commodities`` and returns parallel arrays, with every cell's new
+    points concatenated into ``values`` and split by ``counts``.
+    """
+    if since is None and since_day is not None:
+        since = deltas.version_of_day(since_day)
+    changes = new_point_counts(snapshot, deltas, since) if since is not None else None
+    full = changes is None
+    counts, revised = changes if changes is not None else (None, None)
+
+    series = []
+    for i, j in cells:
+        history = snapshot.history.cell(i, j)
+        n = len(history) if full else min(int(counts[i, j]), len(history))
+        # A revised point that has since dropped out of the retained history is not sent
+        series.append((i, j, history[len(history) - n:], not full and revised[i, j] and n == counts[i, j]))
+
+    payload = {"version": snapshot.version, "day": snapshot.day, "since": since, "full": full}
+    if layout == "columnar":
+        payload.update({
+            "regions": list(snapshot.regions),
+            "commodities": list(snapshot.commodity_names),
+            "region_index": [i for i, _, _, _ in series],
+            "commodity_index": [j for _, j, _, _ in series],
+            "current_prices": [float(snapshot.prices[i, j]) for i, j, _, _ in series],
+            "counts": [len(values) for _, _, values, _ in series],
+            "revised": [bool(cell_revised) for _, _, _, cell_revised in series],
+            "values": np.concatenate([values for _, _, values, _ in series]) if series else np.empty(0)
+        })
+    else:
+        market = {}
+        for i, j, values, cell_revised in series:
+            market.setdefault(snapshot.regions[i], {})[snapshot.commodity_names[j]] = {
+                "current_price": float(snapshot.prices[i, j]),
+                "history": values,
+                "revised": bool(cell_revised)
+            }
+        payload["market"] = market
+    return payload
+
+
+def encode(payload, encoding="json", default=None):
+    """Serialize a batch payload as JSON or msgpack; msgpack carries ``values`` as raw little-endian float64"""
+    if encoding == "msgpack":
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        if isinstance(payload.get("values"), np.ndarray):
+            payload = dict(payload, values=payload["values"].astype("<f8").tobytes())
+        return msgpack.packb(payload, default=default, use_bin_type=True)
+    return json.dumps(payload, separators=(",", ":"), default=default).encode()
+
+
+def compress(body):
+    return gzip.compress(body, compresslevel=5)
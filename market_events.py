@@ -0,0 +1,120 @@
+import heapq
+import itertools
+
+import numpy as np
+
+# Furthest ahead an event may be scheduled, and longest its effect may last, in market days
+MAX_SCHEDULE_DAYS = 3650
+MAX_EFFECT_DAYS = 365
+
+
+class EventQueue:
+    """Events scheduled for future market days, and the fading effects of events already applied.
+
+    Scheduled events wait in a heap ordered by day, then by the order they were
+    scheduled in, and are applied by the tick of their day. An event with a
+    ``duration`` raises each of its commodities by ``change * decay ** age`` on the
+    ``age``-th day after it was applied and is gone after ``duration`` days; without
+    one it changes prices once, for good. The effects still running are kept as flat
+    per-commodity arrays, so a tick folds all of them into the market at once.
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self._heap = []         # (day, order, event record)
+        self._order = itertools.count()
+        self._active = []       # records of applied events whose effects have not run out, oldest first
+        self._rows = np.zeros(0, dtype=np.intp)
+        self._cols = np.zeros(0, dtype=np.intp)
+        self._changes = np.zeros(0)
+        self._starts = np.zeros(0, dtype=np.int64)
+        self._durations = np.zeros(0, dtype=np.int64)
+        self._decays = np.zeros(0)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def copy(self):
+        """An independent queue in the same state, for simulating days without committing to them"""
+        queue = EventQueue(self.world)
+        queue._heap = list(self._heap)
+        queue._order = itertools.count(next(self._order))
+        queue._active = list(self._active)
+        for name in ("_rows", "_cols", "_changes", "_starts", "_durations", "_decays"):
+            setattr(queue, name, getattr(self, name))
+        return queue
+
+    def load(self, scheduled, active):
+        """Restore the queue from the ``scheduled()`` and ``active()`` lists it was saved as"""
+        for record in scheduled:
+            self.schedule(record)
+        for record in active:
+            self.activate(record)
+
+    def resolve(self, record):
+        """Region index, commodity indices and fractional changes of an event record's effects"""
+        i = self.world.region_index[record["region"]]
+        effects = [(self.world.commodity_index[commodity], change) for commodity, change in record["effects"].items()
+                   if commodity in self.world.commodity_index]
+        cols = np.array([j for j, _ in effects], dtype=np.intp)
+        changes = np.array([change for _, change in effects], dtype=float)
+        return i, cols, changes
+
+    def schedule(self, record):
+        heapq.heappush(self._heap, (record["day"], next(self._order), record))
+
+    def due(self, day):
+        """Remove and return the events scheduled on or before ``day``, in the order they are applied"""
+        records = []
+        while self._heap and self._heap[0][0] <= day:
+            records.append(heapq.heappop(self._heap)[2])
+        return records
+
+    def scheduled(self):
+        return [record for _, _, record in sorted(self._heap, key=lambda entry: entry[:2])]
+
+    def active(self):
+        return list(self._active)
+
+    def activate(self, record, i=None, cols=None, changes=None):
+        """Start the lasting effect of an event just applied on its day; permanent events have none"""
+        if not record.get("duration"):
+            return
+        if i is None:
+            i, cols, changes = self.resolve(record)
+        self._active.append(record)
+        n = len(cols)
+        self._rows = np.concatenate([self._rows, np.full(n, i, dtype=np.intp)])
+        self._cols = np.concatenate([self._cols, cols])
+        self._changes = np.concatenate([self._changes, changes])
+        self._starts = np.concatenate([self._starts, np.full(n, record["day"], dtype=np.int64)])
+        self._durations = np.concatenate([self._durations, np.full(n, record["duration"], dtype=np.int64)])
+        self._decays = np.concatenate([self._decays, np.full(n, record.get("decay", 1.0))])
+
+    def factors(self, day):
+        """Multipliers the running effects put on every cell's prices in the tick of ``day``, or None.
+
+        An effect moves from one day's strength to the next as the ratio of the two,
+        so the market keeps its own moves in between.
+        """
+        if not len(self._starts):
+            return None
+        age = day - self._starts
+        now = np.where(age < self._durations, self._changes * self._decays ** age, 0.0)
+        before = self._changes * self._decays ** (age - 1)
+        factors = np.ones(self.world.modifier_matrix.shape)
+        np.multiply.at(factors, (self._rows, self._cols), np.maximum(1 + now, 0.01) / np.maximum(1 + before, 0.01))
+        return factors
+
+    def expire(self, day):
+        """Drop the effects that have run out by the end of ``day``"""
+        running = day - self._starts < self._durations
+        if not running.all():
+            for name in ("_rows", "_cols", "_changes", "_starts", "_durations", "_decays"):
+                setattr(self, name, getattr(self, name)[running])
+            self._active = [record for record in self._active if record["day"] + record["duration"] > day]
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes
+                   for name in ("_rows", "_cols", "_changes", "_starts", "_durations", "_decays"))
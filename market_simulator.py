@@ -1,131 +1,259 @@
-import random
-import json
+import contextlib
 import os
+import threading
 from datetime import datetime, timedelta
 
+import numpy as np
+
+from market_analytics import RunningAnalytics
+from market_archive import CHECKPOINT_DAYS, MarketArchive
+from market_events import MAX_EFFECT_DAYS, MAX_SCHEDULE_DAYS, EventQueue
+from market_snapshot import MarketSnapshot
+from market_stream import DeltaJournal, journal_size
+from market_store import MarketStore
+from metrics import timed
+from price_history import PriceHistory
+from price_rollups import rollup_tiers
+from result_cache import FragmentCache, VersionedCache
+from world import WorldError, get_world
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
 class MarketSimulator:
-    def __init__(self):
-        # Base commodity data from 1340 CE, in D&D 5e currency (gp, sp, cp)
-        self.commodities = {
-            "wheat": {"base_price": 0.01, "unit": "cp/lb", "volatility": 0.1},
-            "wool": {"base_price": 5.0, "unit": "sp/lb", "volatility": 0.15},
-            "salt": {"base_price": 0.05, "unit": "cp/lb", "volatility": 0.1},
-            "pepper": {"base_price": 1.5, "unit": "gp/lb", "volatility": 0.3},
-            "saffron": {"base_price": 15.0, "unit": "gp/lb", "volatility": 0.4},
-            "wine": {"base_price": 4.0, "unit": "sp/gallon", "volatility": 0.15},
-            "olive_oil": {"base_price": 7.0, "unit": "sp/gallon", "volatility": 0.2},
-            "herring": {"base_price": 0.04, "unit": "cp/lb", "volatility": 0.1},
-            "iron": {"base_price": 0.1, "unit": "sp/lb", "volatility": 0.1},
-            "copper": {"base_price": 0.5, "unit": "sp/lb", "volatility": 0.15},
-            "silver": {"base_price": 5.0, "unit": "gp/lb", "volatility": 0.2},
-            "timber": {"base_price": 1.5, "unit": "sp/cubic foot", "volatility": 0.2},
-            "furs": {"base_price": 1.5, "unit": "gp/lb", "volatility": 0.3},
-            "woad": {"base_price": 3.0, "unit": "sp/lb", "volatility": 0.15},
-            "madder": {"base_price": 2.0, "unit": "sp/lb", "volatility": 0.15}
-        }
+    def __init__(self, seed=None, market_file="market_state.json", history_days=30, verify_analytics=False,
+                 world=None, checkpoint_days=CHECKPOINT_DAYS):
+        # Commodities, regions and events come from a world definition file (worlds/default.json
+        # unless ``world`` names another file or passes a definition dict), compiled to index tables
+        self.world = get_world(world)
+        self.commodities = self.world.commodities
+        self.region_modifiers = self.world.region_modifiers
+        self.events_by_region = self.world.events_by_region
+        self.transport_costs = self.world.transport_costs
 
-        # Region-specific price modifiers (percentage increase/decrease)
-        self.region_modifiers = {
-            "Red Expanse": {
-                "timber": 0.2, "wine": 0.15, "olive_oil": 0.15, "pepper": 0.1, "saffron": 0.1, "iron": -0.1, "copper": -0.1, "silver": -0.05
-            },
-            "Verdania": {
-                "timber": -0.1, "iron": 0.1, "silver": 0.1
-            },
-            "Solara": {
-                "pepper": -0.05, "saffron": -0.05, "silver": 0.1
-            },
-            "Frostveil": {
-                "pepper": 0.2, "saffron": 0.2, "furs": -0.1
-            },
-            "Eldergraze": {
-                "wheat": -0.1, "wool": -0.05, "madder": -0.05
-            },
-            "Ironcrag": {
-                "iron": -0.1, "copper": -0.1, "furs": -0.05
-            },
-            "Saffronveil": {
-                "pepper": -0.1, "saffron": -0.1, "timber": 0.1
-            },
-            "Mirehold": {
-                "herring": -0.1, "woad": -0.05
-            }
-        }
+        self.market_file = market_file
+        self.store = MarketStore(self.market_file)
+        self.history_days = history_days
+        self.verify_analytics = verify_analytics
+        self.result_cache = VersionedCache()
+        # Rendered per-region page fragments, kept until their region changes
+        self.fragments = FragmentCache()
 
-        # Events by region
-        self.events_by_region = {
-            "Red Expanse": [
-                {"description": "Sandstorm halts rail transport", "effects": {"timber": 0.2, "olive_oil": 0.15, "wine": 0.1}},
-                {"description": "Mine collapse", "effects": {"iron": 0.2, "copper": 0.2, "silver": 0.25}},
-                {"description": "Bandit raid on railway", "effects": {"pepper": 0.2, "furs": 0.2, "silver": 0.15}}
-            ],
-            "Verdania": [
-                {"description": "Forest fire", "effects": {"timber": 0.2, "woad": 0.15, "furs": 0.1}},
-                {"description": "Poor harvest", "effects": {"wheat": 0.15, "wool": 0.1}},
-                {"description": "Druidic blessing", "effects": {"timber": -0.1, "woad": -0.1}}
-            ],
-            "Solara": [
-                {"description": "Disease outbreak", "effects": {"wine": 0.2, "olive_oil": 0.2, "herring": 0.15}},
-                {"description": "Pirate attack", "effects": {"pepper": 0.25, "saffron": 0.25, "wine": 0.1}},
-                {"description": "Trade boom", "effects": {"pepper": -0.1, "saffron": -0.1}}
-            ],
-            "Frostveil": [
-                {"description": "Flood", "effects": {"furs": 0.2, "herring": 0.2, "timber": 0.15}},
-                {"description": "Blizzard", "effects": {"furs": 0.25, "herring": 0.1}},
-                {"description": "Tribal truce", "effects": {"furs": -0.1, "herring": -0.05}}
-            ],
-            "Eldergraze": [
-                {"description": "Drought", "effects": {"wheat": 0.2, "wool": 0.15, "madder": 0.1}},
-                {"description": "Grassland fire", "effects": {"wheat": 0.15, "wool": 0.1}},
-                {"description": "Bumper crop", "effects": {"wheat": -0.1, "madder": -0.1}}
-            ],
-            "Ironcrag": [
-                {"description": "Avalanche", "effects": {"iron": 0.2, "copper": 0.2, "silver": 0.25}},
-                {"description": "Mine strike", "effects": {"iron": 0.15, "copper": 0.15}},
-                {"description": "New vein discovery", "effects": {"iron": -0.1, "copper": -0.1}}
-            ],
-            "Saffronveil": [
-                {"description": "Monsoon", "effects": {"pepper": 0.2, "saffron": 0.2, "timber": 0.15}},
-                {"description": "War with rivals", "effects": {"pepper": 0.25, "saffron": 0.25}},
-                {"description": "Spice harvest", "effects": {"pepper": -0.1, "saffron": -0.1}}
-            ],
-            "Mirehold": [
-                {"description": "Swamp flood", "effects": {"herring": 0.2, "woad": 0.15}},
-                {"description": "Pest infestation", "effects": {"herring": 0.15, "woad": 0.1}},
-                {"description": "Fishing boom", "effects": {"herring": -0.1, "woad": -0.05}}
-            ]
-        }
+        # Dense region x commodity tables used by the vectorized tick engine
+        self.regions = self.world.regions
+        self.commodity_names = self.world.commodity_names
+        self.region_index = self.world.region_index
+        self.commodity_index = self.world.commodity_index
+        self.base_prices = self.world.base_prices
+        self.volatilities = self.world.volatilities
+        self.price_floors = 0.1 * self.base_prices
+        self.modifier_matrix = self.world.modifier_matrix
+
+        # Changes per version for stream clients, published together with each snapshot;
+        # pending deltas are grouped per logged record
+        self.deltas = DeltaJournal(journal_size(self.modifier_matrix.size))
+        self._pending_deltas = []
+
+        # Ticks, events and saves run one at a time; readers use the published snapshot
+        self._write_lock = threading.RLock()
+        with self._write_lock, self.store.locked():
+            self.load_state()
+
+            # Checkpoints and events for point-in-time queries; ``seed`` only applies to a new archive,
+            # an existing market keeps the seed its past days were simulated with
+            self.archive = MarketArchive(self.market_file, self.prices.shape, checkpoint_days)
+            self.seed = self.archive.open(seed, self.day, self.prices, self.store.seq,
+                                          layout=[self.regions, self.commodity_names])
 
-        self.market_file = "market_state.json"
-        self.market, self.last_events, self.event_history = self.load_market()
+    @timed("load_state")
+    def load_state(self):
+        """Rebuild the in-memory market from the latest snapshot plus the log tail and publish it"""
+        new_market = not os.path.exists(self.market_file)
+        market, self.last_events, self.event_history, self.day, scheduled, active = self.load_market()
+
+        # The snapshot, and the log after it, are laid out in the regions and commodities of the world
+        # they were written with. If the world has gained or lost any since, new cells start at their
+        # base price and cells no longer in the world are dropped.
+        saved_layout = (list(market), list(next(iter(market.values()), {})))
+        reshaped = saved_layout != (self.regions, self.commodity_names)
+        if reshaped:
+            market = {region: {commodity: market.get(region, {}).get(commodity)
+                               or {"current_price": data["base_price"], "history": [data["base_price"]]}
+                               for commodity, data in self.commodities.items()}
+                      for region in self.regions}
+            self.last_events = {region: self.last_events.get(region) for region in self.regions}
+            self.event_history = [record for record in self.event_history if record["region"] in self.region_index]
+            scheduled = [record for record in scheduled if record["region"] in self.region_index]
+            active = [record for record in active if record["region"] in self.region_index]
+
+        self.prices = np.array([
+            [market[region][commodity]["current_price"] for commodity in self.commodity_names]
+            for region in self.regions
+        ])
+
+        # Price history lives in one append-only float64 buffer that snapshots can share
+        self.history = PriceHistory(self.prices.shape, self.history_days)
+        for i, region in enumerate(self.regions):
+            for j, commodity in enumerate(self.commodity_names):
+                self.history.set_cell(i, j, market[region][commodity]["history"])
+
+        # Analytics are maintained incrementally; verify mode cross-checks them against a full rescan
+        self.analytics = RunningAnalytics(self.history)
+
+        # Daily, weekly and monthly OHLC buckets, saved with the snapshot; without them they start from today
+        self.rollups = rollup_tiers(self.prices.shape, self.history_days)
+        arrays = None if reshaped else self.store.load_arrays()
+        if arrays is None or not all(tier.load_arrays(arrays) for tier in self.rollups):
+            self.rollups = rollup_tiers(self.prices.shape, self.history_days)
+            for tier in self.rollups:
+                tier.observe(self.day, self.prices)
+
+        # Events waiting for their day and the effects of applied ones that are still fading
+        self.events = EventQueue(self.world)
+        self.events.load(scheduled, active)
+
+        # Bring the snapshot up to date with everything logged after it
+        self._replay(self.store.read_log(), saved_layout if reshaped else None)
+
+        # Monotonic market version: the sequence number of the last logged tick or event
+        self.version = self.store.seq
+        # Version at which each region's prices last changed; everything counts as changed on load
+        self.region_stamps = np.full(len(self.regions), self.version)
+        self._pending_deltas = []
+        self.deltas.reset(self.version)
+        self._publish()
+
+        # Later records are logged in the current layout, so a new or reshaped market is snapshotted first
+        if new_market or reshaped:
+            self.store.write_snapshot(self._snapshot.to_state, build_arrays=self._snapshot.rollup_arrays)
 
     def load_market(self):
-        """Load market state from file or initialize with base prices for each region"""
-        if os.path.exists(self.market_file):
-            with open(self.market_file, 'r') as f:
-                data = json.load(f)
-                return (data.get("market", {}), 
-                       data.get("last_events", {}), 
-                       data.get("event_history", []))
+        """Load market state from the latest snapshot or initialize with base prices for each region"""
+        data = self.store.load_snapshot()
+        if data is not None:
+            return (data.get("market", {}), 
+                   data.get("last_events", {}), 
+                   data.get("event_history", []),
+                   data.get("day", 0),
+                   data.get("scheduled_events", []),
+                   data.get("active_events", []))
         
         # Initialize market with separate price history for each region
         market = {region: {comm: {"current_price": data["base_price"], "history": [data["base_price"]]} 
                           for comm, data in self.commodities.items()} 
-                 for region in self.region_modifiers.keys()}
+                 for region in self.regions}
         
-        last_events = {region: None for region in self.region_modifiers.keys()}
+        last_events = {region: None for region in self.regions}
         event_history = []
         
-        return market, last_events, event_history
+        return market, last_events, event_history, 0, [], []
+
+    def replay_log(self):
+        """Re-apply the ticks and events logged since the last snapshot"""
+        self._replay(self.store.read_log())
 
+    @timed("replay")
+    def _replay(self, records, layout=None):
+        """Apply logged records, whose ticks are laid out in ``layout`` (regions, commodities) if given"""
+        regions, commodities = layout or (self.regions, self.commodity_names)
+        if layout is not None:
+            # Cells the saved layout shares with the world, by name
+            rows = [(i, regions.index(region)) for i, region in enumerate(self.regions) if region in regions]
+            cols = [(j, commodities.index(commodity)) for j, commodity in enumerate(self.commodity_names)
+                    if commodity in commodities]
+            (new_rows, old_rows), (new_cols, old_cols) = (np.array(pairs, dtype=np.intp).reshape(-1, 2).T
+                                                          for pairs in (rows, cols))
+
+        for record in records:
+            if record["type"] == "tick":
+                prices = np.array(record["prices"], dtype=float)
+                if prices.shape != (len(regions), len(commodities)):
+                    raise WorldError(
+                        f"{self.store.log_file} holds ticks for a world of shape {prices.shape}, not "
+                        f"{len(regions)} regions x {len(commodities)} commodities; start the market once with "
+                        f"the world it was written with so that it is snapshotted, then switch worlds")
+                if layout is not None:
+                    remapped = self.prices.copy()
+                    remapped[np.ix_(new_rows, new_cols)] = prices[np.ix_(old_rows, old_cols)]
+                    prices = remapped
+                self._apply_path(prices[np.newaxis])
+            elif record["type"] in ("events", "event"):
+                # Single events were logged one at a time before events could be scheduled
+                events = record["events"] if record["type"] == "events" else [record["event"]]
+                events = [event for event in events if event["region"] in self.region_index]
+                if events:
+                    self._apply_events(events)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold off every other writer, in this process and in others sharing the state files"""
+        with self._write_lock, self.store.locked():
+            yield
+
+    def snapshot(self):
+        """The latest published market state, first picking up writes made by other processes"""
+        if self.store.changed_on_disk():
+            self.sync()
+        return self._snapshot
+
+    def sync(self):
+        """Apply ticks and events that other processes sharing the state files have logged"""
+        with self._write_lock, self.store.locked():
+            self._catch_up()
+
+    def _catch_up(self):
+        if not self.store.changed_on_disk():
+            return
+        records = self.store.read_new_records()
+        if records is None:
+            # The records we are missing were compacted into a newer snapshot
+            self.load_state()
+            return
+        self._replay(records)
+        self.version = self.store.seq
+        self._publish()
+
+    def _publish(self):
+        # The deltas of each logged record share its version, numbered up to the version being published
+        first = self.version - len(self._pending_deltas) + 1
+        for version, deltas in enumerate(self._pending_deltas, first):
+            for event, data in deltas:
+                if event == "tick":
+                    self.region_stamps[:] = version
+                elif event == "event":
+                    self.region_stamps[self.region_index[data["region"]]] = version
+
+        # A single reference assignment, so readers see either the old or the new state
+        self._snapshot = MarketSnapshot(self)
+
+        for version, deltas in enumerate(self._pending_deltas, first):
+            for event, data in deltas:
+                self.deltas.publish(version, event, data)
+        self._pending_deltas = []
+
+    @timed("save_market")
     def save_market(self):
-        """Save market state and last events to file"""
-        with open(self.market_file, 'w') as f:
-            json.dump({
-                "market": self.market, 
-                "last_events": self.last_events,
-                "event_history": self.event_history
-            }, f, indent=4)
+        """Write a full snapshot of market state and compact the log"""
+        with self._write_lock:
+            self.store.wait()
+            with self.store.locked():
+                self._catch_up()
+                self.store.write_snapshot(self._snapshot.to_state, build_arrays=self._snapshot.rollup_arrays)
+
+    def _commit(self, records):
+        """Log applied records, publish the new state and snapshot in the background when the log gets long"""
+        self.version = self.store.append(records)
+        self._publish()
+        if self.store.needs_snapshot():
+            self.store.write_snapshot(self._snapshot.to_state, background=True,
+                                      build_arrays=self._snapshot.rollup_arrays)
+
+    def memory_usage(self):
+        """Approximate bytes held by the market's arrays, its delta journal and its caches"""
+        return (self.prices.nbytes + self.history.nbytes + self.analytics.nbytes
+                + sum(tier.nbytes for tier in self.rollups) + self.events.nbytes
+                + self.deltas.nbytes + self.result_cache.nbytes + self.fragments.nbytes)
 
     def format_price(self, price, unit):
         """Format price in D&D currency (gp, sp, cp)"""
@@ -138,215 +266,314 @@ class MarketSimulator:
 
     def update_prices(self):
         """Simulate one day's price changes for all regions"""
-        for region in self.market.keys():
-            for commodity, data in self.commodities.items():
-                current_price = self.market[region][commodity]["current_price"]
-                volatility = data["volatility"]
-                
-                # Random fluctuation
-                change = random.gauss(0, volatility) * current_price
-                new_price = max(0.1 * data["base_price"], current_price + change)
-                
-                # Apply region-specific modifier
-                if region in self.region_modifiers and commodity in self.region_modifiers[region]:
-                    new_price *= (1 + self.region_modifiers[region][commodity])
-                
-                self.market[region][commodity]["current_price"] = new_price
-                self.market[region][commodity]["history"].append(new_price)
-                
-                # Keep only last 30 days
-                if len(self.market[region][commodity]["history"]) > 30:
-                    self.market[region][commodity]["history"].pop(0)
-        
-        self.save_market()
+        self.advance_days(1)
+
+    @timed("advance_days")
+    def advance_days(self, days):
+        """Simulate several days of price changes in one batch and persist them with a single write"""
+        if days < 1:
+            return
+
+        with self._write_lock, self.store.locked():
+            self._catch_up()
+
+            # Simulate on a copy of the event queue; _apply_path moves the real one along
+            queue = self.events.copy()
+            path = np.empty((days,) + self.prices.shape)
+            fired = []
+            prices = self.prices
+            for k in range(days):
+                day = self.day + k + 1
+                prices = self._tick_prices(prices, day, queue.factors(day))
+                queue.expire(day)
+                for record in queue.due(day):
+                    i, cols, changes = queue.resolve(record)
+                    self._event_prices(prices, i, cols, changes)
+                    queue.activate(record, i, cols, changes)
+                    fired.append((day, self.store.seq + k + 1, record))
+                path[k] = prices
+
+            self.archive.record_events(fired)
+            self.archive.record_ticks(self.day + 1, path)
+            self._apply_path(path)
+            self._commit([{"type": "tick", "prices": day_prices.tolist()} for day_prices in path])
+
+    def advance_to_day(self, day):
+        """Advance the market until it reaches ``day``; returns how many days that took.
+
+        The check and the advance happen under the write locks, so callers racing to
+        reach the same day (in this process or another) never apply a day twice.
+        """
+        with self.locked():
+            self._catch_up()
+            days = day - self.day
+            self.advance_days(days)
+            return max(days, 0)
+
+    def _apply_path(self, path):
+        """Apply a days x regions x commodities block of simulated prices.
 
-    def trigger_event(self, region, event_index):
-        """Apply event-based price changes"""
+        The prices already include the events scheduled for those days; the event
+        queue is moved along to match.
+        """
+        self.prices = path[-1].copy()
+        for k, day_prices in enumerate(path):
+            day = self.day + k + 1
+            deltas = [("tick", {"day": day, "prices": day_prices})]
+            self.events.expire(day)
+            for record in self.events.due(day):
+                i, cols, changes = self.events.resolve(record)
+                self.events.activate(record, i, cols, changes)
+                self._record_event(record)
+                deltas.append(("event", self._event_delta(record, i, cols, day_prices)))
+            self._pending_deltas.append(deltas)
+            for tier in self.rollups:
+                tier.observe(day, day_prices)
+        self.day += len(path)
+        for day_prices in path[-self.history.capacity:]:
+            self.history.append(day_prices)
+            self.analytics.observe()
+
+    @timed("trigger_event")
+    def trigger_event(self, region, event_index, in_days=0, duration=None, decay=1.0):
+        """Apply an event now, or schedule it ``in_days`` market days ahead; returns (success, message)"""
+        event = {"region": region, "event_index": event_index, "in_days": in_days, "duration": duration,
+                 "decay": decay}
         try:
-            if region not in self.events_by_region:
-                return False, "Invalid region"
-            
-            if event_index >= len(self.events_by_region[region]):
-                return False, "Invalid event index"
-            
-            event = self.events_by_region[region][event_index]
-            
-            # Record event in history
-            event_record = {
-                "timestamp": datetime.now().isoformat(),
-                "region": region,
-                "description": event["description"],
-                "effects": event["effects"]
-            }
-            self.event_history.append(event_record)
-            
-            # Keep only last 50 events
-            if len(self.event_history) > 50:
-                self.event_history.pop(0)
-            
-            self.last_events[region] = event['description']
-            
-            for commodity, change in event["effects"].items():
-                if commodity in self.market[region]:
-                    self.market[region][commodity]["current_price"] *= (1 + change)
-                    self.market[region][commodity]["current_price"] = max(
-                        0.1 * self.commodities[commodity]["base_price"], 
-                        self.market[region][commodity]["current_price"]
-                    )
-                    self.market[region][commodity]["history"].append(
-                        self.market[region][commodity]["current_price"]
-                    )
-                    if len(self.market[region][commodity]["history"]) > 30:
-                        self.market[region][commodity]["history"].pop(0)
-            
-            self.save_market()
-            return True, f"Event '{event['description']}' triggered in {region}"
-        
+            record, = self.trigger_events([event])
+        except ValueError as e:
+            return False, str(e)
         except Exception as e:
             return False, f"Error triggering event: {str(e)}"
+        if record.get("scheduled"):
+            return True, f"Event '{record['description']}' scheduled in {region} for day {record['day']}"
+        return True, f"Event '{record['description']}' triggered in {region}"
 
-    def calculate_profit_opportunities(self, export_region, import_region):
-        """Calculate profit opportunities between two regions"""
-        opportunities = []
-        
-        for commodity in self.commodities.keys():
-            export_price = self.market[export_region][commodity]["current_price"]
-            import_price = self.market[import_region][commodity]["current_price"]
-            
-            profit_margin = import_price - export_price
-            profit_percentage = (profit_margin / export_price) * 100 if export_price > 0 else 0
-            
-            opportunities.append({
-                "commodity": commodity,
-                "export_price": export_price,
-                "import_price": import_price,
-                "profit_margin": profit_margin,
-                "profit_percentage": profit_percentage,
-                "unit": self.commodities[commodity]["unit"]
-            })
-        
-        # Sort by profit percentage descending
-        opportunities.sort(key=lambda x: x["profit_percentage"], reverse=True)
-        return opportunities
+    @timed("trigger_events")
+    def trigger_events(self, events):
+        """Apply and schedule a batch of events atomically, persisted with a single write.
 
-    def calculate_volatility_analysis(self):
-        """Calculate volatility analysis for all commodities"""
-        analysis = {}
-        
-        for commodity in self.commodities.keys():
-            regional_volatilities = []
-            
-            for region in self.region_modifiers.keys():
-                history = self.market[region][commodity]["history"]
-                if len(history) > 1:
-                    changes = []
-                    for i in range(1, len(history)):
-                        change = abs((history[i] - history[i-1]) / history[i-1])
-                        changes.append(change)
-                    volatility = sum(changes) / len(changes) if changes else 0
-                    regional_volatilities.append(volatility)
-            
-            avg_volatility = sum(regional_volatilities) / len(regional_volatilities) if regional_volatilities else 0
-            analysis[commodity] = {
-                "average_volatility": avg_volatility,
-                "base_volatility": self.commodities[commodity]["volatility"],
-                "volatility_rating": "High" if avg_volatility > 0.15 else "Medium" if avg_volatility > 0.05 else "Low"
-            }
-        
-        return analysis
+        Each event is a dict naming a ``region`` and the ``event_index`` of one of its
+        events. It may also give the market ``day`` to apply it on, or how many days
+        from now (``in_days``; today by default), and a ``duration`` in days for an
+        effect that fades by ``decay`` per day and then wears off instead of lasting
+        for good. Returns the event records; raises
+        ValueError without touching the market if any event is invalid.
+        """
+        if not events:
+            raise ValueError("No events given")
+        with self._write_lock, self.store.locked():
+            self._catch_up()
+            records = [self._event_record(event) for event in events]
+            seq = self.store.seq + 1
+            self.archive.record_events([(self.day, seq, record) for record in records if record["day"] == self.day])
+            self._apply_events(records)
+            self._commit([{"type": "events", "events": records}])
+        return records
 
-    def calculate_trend_analysis(self):
-        """Calculate trend analysis for all commodities and regions"""
-        analysis = {}
-        
-        for region in self.region_modifiers.keys():
-            analysis[region] = {}
-            for commodity in self.commodities.keys():
-                history = self.market[region][commodity]["history"]
-                if len(history) >= 2:
-                    recent_change = (history[-1] - history[-2]) / history[-2] * 100
-                    
-                    if len(history) >= 7:
-                        week_change = (history[-1] - history[-7]) / history[-7] * 100
-                    else:
-                        week_change = recent_change
-                    
-                    trend = "Rising" if recent_change > 2 else "Falling" if recent_change < -2 else "Stable"
-                    
-                    analysis[region][commodity] = {
-                        "recent_change": recent_change,
-                        "week_change": week_change,
-                        "trend": trend
-                    }
-                else:
-                    analysis[region][commodity] = {
-                        "recent_change": 0,
-                        "week_change": 0,
-                        "trend": "Stable"
-                    }
-        
-        return analysis
+    def _event_record(self, event):
+        """Validate one event of a batch and build its log record"""
+        if not isinstance(event, dict):
+            raise ValueError("Each event must be an object")
+        region = event.get("region")
+        i = self.region_index.get(region) if isinstance(region, str) else None
+        if i is None:
+            raise ValueError(f"Invalid region: {region}")
+        event_index = event.get("event_index")
+        if not _is_int(event_index) or not 0 <= event_index < self.world.event_count(i):
+            raise ValueError(f"Invalid event index for {region}: {event_index}")
+        in_days = event.get("in_days", 0)
+        day = event["day"] if "day" in event else self.day + in_days if _is_int(in_days) else None
+        if not _is_int(day) or not self.day <= day <= self.day + MAX_SCHEDULE_DAYS:
+            raise ValueError(f"Event day must be between day {self.day} and day {self.day + MAX_SCHEDULE_DAYS}")
+        duration = event.get("duration")
+        if duration is not None and (not _is_int(duration) or not 1 <= duration <= MAX_EFFECT_DAYS):
+            raise ValueError(f"Event duration must be between 1 and {MAX_EFFECT_DAYS} days")
+        decay = event.get("decay", 1.0)
+        if isinstance(decay, bool) or not isinstance(decay, (int, float)) or not 0 <= decay <= 1:
+            raise ValueError("Event decay must be between 0 and 1")
 
-    def calculate_regional_performance(self):
-        """Calculate regional market performance"""
-        performance = {}
+        description, cols, changes = self.world.event(i, event_index)
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "region": region,
+            "description": description,
+            "effects": {self.commodity_names[j]: change for j, change in zip(cols.tolist(), changes.tolist())},
+            "day": day
+        }
+        if day > self.day:
+            record["scheduled"] = True
+        if duration is not None:
+            record.update(duration=duration, decay=float(decay))
+        return record
+
+    def _apply_events(self, records):
+        """Apply the events of one logged batch that fall on today and queue the rest.
+
+        Events move today's prices, so they revise the day's history point rather than
+        adding one.
+        """
+        applied, cells = [], set()
+        for record in records:
+            if record.get("day", self.day) > self.day:
+                self.events.schedule(record)
+                applied.append((record, None, None))
+                continue
+            i, cols, changes = self.events.resolve(record)
+            self._event_prices(self.prices, i, cols, changes)
+            self.events.activate(record, i, cols, changes)
+            self._record_event(record)
+            applied.append((record, i, cols))
+            cells.update((i, j) for j in cols.tolist())
+
+        if cells:
+            rows, cols = (np.array(axis) for axis in zip(*sorted(cells)))
+            self.history.revise_last(self.prices[rows, cols], rows, cols)
+            self.analytics.revise(rows, cols)
+            for tier in self.rollups:
+                tier.revise(self.prices[rows, cols], rows, cols)
+
+        # Event deltas carry the prices the whole batch left behind
+        deltas = []
+        for record, i, cols in applied:
+            if i is None:
+                deltas.append(("scheduled", {"region": record["region"], "description": record["description"],
+                                             "day": record["day"]}))
+            else:
+                deltas.append(("event", self._event_delta(record, i, cols, self.prices)))
+        self._pending_deltas.append(deltas)
+
+    def _record_event(self, event_record):
+        """Add an applied event to the event history and the region's last event"""
+        self.event_history.append(event_record)
         
-        for region in self.region_modifiers.keys():
-            total_value = 0
-            price_changes = []
-            
-            for commodity in self.commodities.keys():
-                current_price = self.market[region][commodity]["current_price"]
-                base_price = self.commodities[commodity]["base_price"]
-                total_value += current_price
-                
-                if len(self.market[region][commodity]["history"]) >= 2:
-                    recent_change = ((self.market[region][commodity]["history"][-1] - 
-                                    self.market[region][commodity]["history"][-2]) / 
-                                   self.market[region][commodity]["history"][-2])
-                    price_changes.append(recent_change)
-            
-            avg_change = sum(price_changes) / len(price_changes) if price_changes else 0
-            
-            performance[region] = {
-                "total_market_value": total_value,
-                "average_change": avg_change * 100,
-                "stability": "Stable" if abs(avg_change) < 0.02 else "Volatile",
-                "last_event": self.last_events.get(region, "None")
-            }
+        # Keep only last 50 events
+        if len(self.event_history) > 50:
+            self.event_history.pop(0)
         
-        return performance
+        self.last_events[event_record["region"]] = event_record['description']
+
+    def _event_delta(self, event_record, i, cols, prices):
+        return {
+            "region": event_record["region"],
+            "description": event_record["description"],
+            "prices": {self.commodity_names[j]: float(prices[i, j]) for j in cols.tolist()}
+        }
+
+    def _tick_prices(self, prices, day, factors=None):
+        """One day's prices following ``prices``, moved by the running event effects' ``factors``.
+
+        Each day's shocks come from their own random stream keyed by the seed and the
+        day, so the archive can recompute any day from the prices before it.
+        """
+        shocks = np.random.default_rng([self.seed, day]).standard_normal(prices.shape) * self.volatilities
+        # Random fluctuation, floored at 10% of base price, then the region-specific modifier
+        prices = np.maximum(self.price_floors, prices + shocks * prices) * self.modifier_matrix
+        if factors is not None:
+            prices = np.maximum(self.price_floors, prices * factors)
+        return prices
+
+    def _event_prices(self, prices, i, cols, changes):
+        """Apply an event's fractional changes to row ``i`` of ``prices`` in place"""
+        prices[i, cols] = np.maximum(self.price_floors[cols], prices[i, cols] * (1 + changes))
+
+    def _recompute(self, first_day, last_day):
+        """Yield (day, prices) at the end of each day from ``first_day`` to ``last_day``, from the archive.
+
+        The yielded array is reused for the next day, so copy what you keep.
+        """
+        checkpoint_day, prices = self.archive.checkpoint(first_day)
+        # Effects of events from before the checkpoint may still be fading
+        queue = EventQueue(self.world)
+        for record in self.archive.events(checkpoint_day - MAX_EFFECT_DAYS, checkpoint_day - 1):
+            if record["region"] in self.region_index:
+                queue.activate(record)
+        queue.expire(checkpoint_day)
+
+        day = checkpoint_day
+        events = self.archive.events(day, last_day)
+        k = 0
+        while True:
+            # A checkpoint holds the prices right after its day's tick, which applied that day's scheduled events
+            while k < len(events) and events[k]["day"] == day:
+                record = events[k]
+                if record["region"] in self.region_index:
+                    i, cols, changes = queue.resolve(record)
+                    if len(cols) and not (day == checkpoint_day and record.get("scheduled")):
+                        self._event_prices(prices, i, cols, changes)
+                    queue.activate(record, i, cols, changes)
+                k += 1
+            if day >= first_day:
+                yield day, prices
+            if day >= last_day:
+                return
+            day += 1
+            prices = self._tick_prices(prices, day, queue.factors(day))
+            queue.expire(day)
+
+    def _check_archived(self, *days):
+        today = self.snapshot().day
+        for day in days:
+            if not self.archive.start_day <= day <= today:
+                raise ValueError(f"Day must be between {self.archive.start_day} and {today}")
+        return today
+
+    @timed("as_of")
+    def as_of(self, day):
+        """Every cell's price at the end of market ``day``, restored from the nearest checkpoint"""
+        if day == self._check_archived(day):
+            return self.snapshot().prices
+        for _, prices in self._recompute(day, day):
+            return prices.copy()
+
+    @timed("price_series")
+    def price_series(self, region, commodity, first_day, last_day):
+        """One cell's end-of-day prices from ``first_day`` through ``last_day``, restored from the archive"""
+        if region not in self.region_index or commodity not in self.commodity_index:
+            raise ValueError(f"Unknown region or commodity: {region}, {commodity}")
+        if first_day > last_day:
+            raise ValueError("The first day must not be after the last day")
+        self._check_archived(first_day, last_day)
+        i, j = self.region_index[region], self.commodity_index[commodity]
+        return [float(prices[i, j]) for _, prices in self._recompute(first_day, last_day)]
+
+    # Getter methods for the web interface, read from the current snapshot
+    @property
+    def market(self):
+        return self.snapshot().market
 
-    # Getter methods for the web interface
     def get_market_data(self):
-        return self.market
+        return self.snapshot().get_market_data()
 
     def get_regions(self):
-        return list(self.region_modifiers.keys())
+        return list(self.regions)
 
     def get_commodities(self):
         return self.commodities
 
     def get_last_events(self):
-        return self.last_events
+        return self.snapshot().get_last_events()
 
     def get_events_by_region(self):
         return self.events_by_region
 
     def get_event_history(self):
-        return self.event_history[-20:]  # Return last 20 events
+        return self.snapshot().get_event_history()
 
     def get_region_data(self, region):
-        if region in self.market:
-            return {region: self.market[region]}
-        return {}
+        return self.snapshot().get_region_data(region)
 
     def get_price_history(self, region, commodity):
-        if region in self.market and commodity in self.market[region]:
-            return {
-                "commodity": commodity,
-                "region": region,
-                "history": self.market[region][commodity]["history"],
-                "unit": self.commodities[commodity]["unit"]
-            }
-        return {}
\ No newline at end of file
+        return self.snapshot().get_price_history(region, commodity)
+
+    def calculate_profit_opportunities(self, export_region, import_region):
+        return self.snapshot().calculate_profit_opportunities(export_region, import_region)
+
+    def calculate_volatility_analysis(self):
+        return self.snapshot().calculate_volatility_analysis()
+
+    def calculate_trend_analysis(self):
+        return self.snapshot().calculate_trend_analysis()
+
+    def calculate_regional_performance(self):
+        return self.snapshot().calculate_regional_performance()
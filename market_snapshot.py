@@ -0,0 +1,406 @@
+from functools import cached_property
+from types import MappingProxyType
+
+import numpy as np
+
+from market_analytics import assert_analytics_match, ordered_sum
+from metrics import timed
+from price_history import MarketCell
+from price_rollups import RESOLUTIONS, lttb, merge_buckets
+from result_cache import versioned
+from trade_routes import DEFAULT_TRANSPORT_COST, best_routes, top_trades, transport_matrix
+
+
+class MarketSnapshot:
+    """Immutable market state as of one version.
+
+    The simulator publishes a new snapshot after every tick or event by swapping a
+    single reference, so a request that reads one snapshot sees a consistent market
+    no matter what writers do in the meantime.
+    """
+
+    def __init__(self, sim):
+        self.version = sim.version
+        self.day = sim.day
+        self.result_cache = sim.result_cache
+        self.verify_analytics = sim.verify_analytics
+
+        # World definition, never mutated after start-up
+        self.world = sim.world
+        self.commodities = sim.commodities
+        self.region_modifiers = sim.region_modifiers
+        self.events_by_region = sim.events_by_region
+        self.regions = sim.regions
+        self.commodity_names = sim.commodity_names
+        self.region_index = sim.region_index
+        self.commodity_index = sim.commodity_index
+        self.volatilities = sim.volatilities
+        self.price_floors = sim.price_floors
+        self.modifier_matrix = sim.modifier_matrix
+        self.transport_costs = sim.transport_costs
+
+        self.prices = sim.prices.copy()
+        self.prices.flags.writeable = False
+        self.history = sim.history.freeze()
+        self.analytics = sim.analytics.freeze()
+        self.rollups = {tier.name: tier.freeze() for tier in sim.rollups}
+        self.last_events = MappingProxyType(dict(sim.last_events))
+        self.event_history = tuple(sim.event_history)
+        self.scheduled_events = tuple(sim.events.scheduled())
+        self.active_events = tuple(sim.events.active())
+
+        # Rendered fragments are shared across versions and re-rendered per region when it changes
+        self.fragments = sim.fragments
+        self.region_stamps = sim.region_stamps.copy()
+        self.region_stamps.flags.writeable = False
+
+    @cached_property
+    def market(self):
+        return {region: {commodity: MarketCell(self, i, j) for j, commodity in enumerate(self.commodity_names)}
+                for i, region in enumerate(self.regions)}
+
+    def to_state(self):
+        """Plain-data form of the snapshot, as persisted to market_state.json"""
+        return {
+            "market": {region: {commodity: cell.to_dict() for commodity, cell in cells.items()}
+                       for region, cells in self.market.items()},
+            "last_events": dict(self.last_events),
+            "event_history": list(self.event_history),
+            "scheduled_events": list(self.scheduled_events),
+            "active_events": list(self.active_events),
+            "day": self.day
+        }
+
+    def rollup_arrays(self):
+        """Every rollup tier as plain arrays, persisted alongside ``to_state``"""
+        arrays = {}
+        for tier in self.rollups.values():
+            arrays.update(tier.to_arrays())
+        return arrays
+
+    @versioned
+    @timed("calculate_profit_opportunities")
+    def calculate_profit_opportunities(self, export_region, import_region):
+        """Calculate profit opportunities between two regions"""
+        opportunities = []
+        i_export, i_import = self.region_index[export_region], self.region_index[import_region]
+        
+        for j, commodity in enumerate(self.commodity_names):
+            export_price = float(self.prices[i_export, j])
+            import_price = float(self.prices[i_import, j])
+            
+            profit_margin = import_price - export_price
+            profit_percentage = (profit_margin / export_price) * 100 if export_price > 0 else 0
+            
+            opportunities.append({
+                "commodity": commodity,
+                "export_price": export_price,
+                "import_price": import_price,
+                "profit_margin": profit_margin,
+                "profit_percentage": profit_percentage,
+                "unit": self.commodities[commodity]["unit"]
+            })
+        
+        # Sort by profit percentage descending
+        opportunities.sort(key=lambda x: x["profit_percentage"], reverse=True)
+        return opportunities
+
+    @versioned
+    @timed("calculate_top_trades")
+    def calculate_top_trades(self, k=10):
+        """The k most profitable single trades across all region pairs"""
+        trades = []
+        for j, i_export, i_import, profit_percentage in top_trades(self.prices, k):
+            commodity = self.commodity_names[j]
+            export_price = float(self.prices[i_export, j])
+            import_price = float(self.prices[i_import, j])
+            trades.append({
+                "commodity": commodity,
+                "export_region": self.regions[i_export],
+                "import_region": self.regions[i_import],
+                "export_price": export_price,
+                "import_price": import_price,
+                "profit_margin": import_price - export_price,
+                "profit_percentage": profit_percentage,
+                "unit": self.commodities[commodity]["unit"]
+            })
+        return trades
+
+    @versioned
+    @timed("calculate_trade_routes")
+    def calculate_trade_routes(self, start=None, max_hops=3, k=10, transport_cost=DEFAULT_TRANSPORT_COST):
+        """The k best chains of up to max_hops trades, optionally starting from one region.
+
+        ``exact`` is False when the world was too large to search exhaustively and the
+        routes are the best an approximate search found.
+        """
+        costs = transport_matrix(self.regions, transport_cost, self.transport_costs)
+        starts = [self.region_index[start]] if start else list(range(len(self.regions)))
+        found, exact = best_routes(self.prices, costs, starts, max_hops, k)
+        routes = []
+        for gain, path, legs in found:
+            routes.append({
+                "path": [self.regions[i] for i in path],
+                "return_percentage": (gain - 1) * 100,
+                "legs": [{
+                    "export_region": self.regions[a],
+                    "import_region": self.regions[b],
+                    "commodity": self.commodity_names[j],
+                    "export_price": float(self.prices[a, j]),
+                    "import_price": float(self.prices[b, j]),
+                    "transport_cost": float(costs[a, b])
+                } for a, b, j in zip(path, path[1:], legs)]
+            })
+        return {"routes": routes, "exact": exact}
+
+    @versioned
+    @timed("calculate_volatility_analysis")
+    def calculate_volatility_analysis(self):
+        """Calculate volatility analysis for all commodities"""
+        analysis = {}
+        volatility = self.analytics.volatility
+        has_returns = self.analytics.return_count > 0
+        
+        for j, commodity in enumerate(self.commodity_names):
+            regional_volatilities = volatility[has_returns[:, j], j]
+            avg_volatility = ordered_sum(regional_volatilities) / len(regional_volatilities) if len(regional_volatilities) else 0
+            analysis[commodity] = {
+                "average_volatility": avg_volatility,
+                "base_volatility": self.commodities[commodity]["volatility"],
+                "volatility_rating": "High" if avg_volatility > 0.15 else "Medium" if avg_volatility > 0.05 else "Low"
+            }
+        
+        if self.verify_analytics:
+            assert_analytics_match("volatility", analysis, self._recompute_volatility_analysis())
+        return analysis
+
+    @versioned
+    @timed("calculate_trend_analysis")
+    def calculate_trend_analysis(self):
+        """Calculate trend analysis for all commodities and regions"""
+        analysis = {}
+        day_change = self.analytics.day_change * 100
+        week_change = self.analytics.week_change * 100
+        
+        for i, region in enumerate(self.regions):
+            analysis[region] = {}
+            for j, commodity in enumerate(self.commodity_names):
+                recent_change = float(day_change[i, j])
+                analysis[region][commodity] = {
+                    "recent_change": recent_change,
+                    "week_change": float(week_change[i, j]),
+                    "trend": "Rising" if recent_change > 2 else "Falling" if recent_change < -2 else "Stable"
+                }
+        
+        if self.verify_analytics:
+            assert_analytics_match("trend", analysis, self._recompute_trend_analysis())
+        return analysis
+
+    @versioned
+    @timed("calculate_regional_performance")
+    def calculate_regional_performance(self):
+        """Calculate regional market performance"""
+        performance = {}
+        stats = self.analytics
+        
+        for i, region in enumerate(self.regions):
+            count = stats.region_change_count[i]
+            avg_change = float(stats.region_change_sum[i]) / count if count else 0
+            
+            performance[region] = {
+                "total_market_value": float(stats.region_value[i]),
+                "average_change": avg_change * 100,
+                "stability": "Stable" if abs(avg_change) < 0.02 else "Volatile",
+                "last_event": self.last_events.get(region, "None")
+            }
+        
+        if self.verify_analytics:
+            assert_analytics_match("regional performance", performance, self._recompute_regional_performance())
+        return performance
+
+    def _recompute_volatility_analysis(self):
+        """Volatility analysis by rescanning every history window"""
+        analysis = {}
+        
+        for commodity in self.commodities.keys():
+            regional_volatilities = []
+            
+            for region in self.region_modifiers.keys():
+                history = self.market[region][commodity]["history"][-self.analytics.window:]
+                if len(history) > 1:
+                    changes = []
+                    for i in range(1, len(history)):
+                        change = abs((history[i] - history[i-1]) / history[i-1])
+                        changes.append(change)
+                    volatility = sum(changes) / len(changes) if changes else 0
+                    regional_volatilities.append(volatility)
+            
+            avg_volatility = sum(regional_volatilities) / len(regional_volatilities) if regional_volatilities else 0
+            analysis[commodity] = {
+                "average_volatility": avg_volatility,
+                "base_volatility": self.commodities[commodity]["volatility"],
+                "volatility_rating": "High" if avg_volatility > 0.15 else "Medium" if avg_volatility > 0.05 else "Low"
+            }
+        
+        return analysis
+
+    def _recompute_trend_analysis(self):
+        """Trend analysis by rescanning every history window"""
+        analysis = {}
+        
+        for region in self.region_modifiers.keys():
+            analysis[region] = {}
+            for commodity in self.commodities.keys():
+                history = self.market[region][commodity]["history"]
+                if len(history) >= 2:
+                    recent_change = (history[-1] - history[-2]) / history[-2] * 100
+                    
+                    if len(history) >= 7:
+                        week_change = (history[-1] - history[-7]) / history[-7] * 100
+                    else:
+                        week_change = recent_change
+                    
+                    trend = "Rising" if recent_change > 2 else "Falling" if recent_change < -2 else "Stable"
+                    
+                    analysis[region][commodity] = {
+                        "recent_change": recent_change,
+                        "week_change": week_change,
+                        "trend": trend
+                    }
+                else:
+                    analysis[region][commodity] = {
+                        "recent_change": 0,
+                        "week_change": 0,
+                        "trend": "Stable"
+                    }
+        
+        return analysis
+
+    def _recompute_regional_performance(self):
+        """Regional performance by rescanning every history window"""
+        performance = {}
+        
+        for region in self.region_modifiers.keys():
+            total_value = 0
+            price_changes = []
+            
+            for commodity in self.commodities.keys():
+                current_price = self.market[region][commodity]["current_price"]
+                base_price = self.commodities[commodity]["base_price"]
+                total_value += current_price
+                
+                if len(self.market[region][commodity]["history"]) >= 2:
+                    recent_change = ((self.market[region][commodity]["history"][-1] - 
+                                    self.market[region][commodity]["history"][-2]) / 
+                                   self.market[region][commodity]["history"][-2])
+                    price_changes.append(recent_change)
+            
+            avg_change = sum(price_changes) / len(price_changes) if price_changes else 0
+            
+            performance[region] = {
+                "total_market_value": total_value,
+                "average_change": avg_change * 100,
+                "stability": "Stable" if abs(avg_change) < 0.02 else "Volatile",
+                "last_event": self.last_events.get(region, "None")
+            }
+        
+        return performance
+
+    @cached_property
+    def previous_prices(self):
+        """Every cell's previous history point, NaN where there is none"""
+        previous = self.history.last(2)
+        previous[self.history.lengths < 2] = np.nan
+        previous.flags.writeable = False
+        return previous
+
+    @cached_property
+    def day_changes(self):
+        """Percent change of every cell since its previous history point, NaN where there is none"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            changes = (self.history.last(1) - self.previous_prices) / self.previous_prices * 100
+        changes.flags.writeable = False
+        return changes
+
+    def region_view(self, i):
+        """Display-ready prices and day-over-day changes of one region's row of the market table"""
+        cells = []
+        for j, commodity in enumerate(self.commodity_names):
+            unit = self.world.units[j]
+            currency = "gp" if "gp" in unit else "sp" if "sp" in unit else "cp"
+            change = float(self.day_changes[i, j])
+            previous = float(self.previous_prices[i, j])
+            cells.append({
+                "commodity": commodity,
+                "price": float(self.prices[i, j]),
+                "previous": None if np.isnan(previous) else previous,
+                "currency": currency,
+                "change": None if np.isnan(change) else abs(change),
+                "trend": "up" if change > 2 else "down" if change < -2 else "flat"
+            })
+        return {"region": self.regions[i], "cells": cells}
+
+    # Getter methods for the web interface
+    def get_market_data(self):
+        return self.market
+
+    def get_regions(self):
+        return list(self.regions)
+
+    def get_commodities(self):
+        return self.commodities
+
+    def get_last_events(self):
+        return self.last_events
+
+    def get_events_by_region(self):
+        return self.events_by_region
+
+    def get_event_history(self):
+        return self.event_history[-20:]  # Return last 20 events
+
+    def get_scheduled_events(self):
+        return self.scheduled_events
+
+    def get_region_data(self, region):
+        if region in self.market:
+            return {region: self.market[region]}
+        return {}
+
+    def get_price_history(self, region, commodity, resolution="raw", max_points=None):
+        """One cell's raw history points, or its OHLC buckets from the daily, weekly or monthly rollup.
+
+        With ``max_points``, raw points are thinned by LTTB (``positions`` gives each kept
+        point's place in the full history) and buckets are merged into longer ones.
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution!r}, expected one of {', '.join(RESOLUTIONS)}")
+        if region in self.market and commodity in self.market[region]:
+            i, j = self.region_index[region], self.commodity_index[commodity]
+            if resolution != "raw":
+                buckets = self.rollups[resolution].buckets(i, j)
+                if max_points is not None:
+                    buckets = merge_buckets(buckets, max_points)
+                columns = list(zip(*buckets)) or [()] * 7
+                return {
+                    "commodity": commodity,
+                    "region": region,
+                    "resolution": resolution,
+                    "buckets": {name: list(column) for name, column in
+                                zip(("day", "open", "high", "low", "close", "mean", "count"), columns)},
+                    "unit": self.commodities[commodity]["unit"]
+                }
+
+            history = self.history.cell(i, j)
+            result = {
+                "commodity": commodity,
+                "region": region,
+                "history": history,
+                "unit": self.commodities[commodity]["unit"]
+            }
+            if max_points is not None:
+                positions = lttb(history, max_points)
+                result.update(resolution=resolution, history=history[positions], positions=positions,
+                              length=len(history))
+            return result
+        return {}
\ No newline at end of file
@@ -0,0 +1,278 @@
+import contextlib
+import json
+import os
+import threading
+import zipfile
+
+import numpy as np
+
+from metrics import PERSISTED_BYTES
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker process
+    fcntl = None
+
+
+def _fsync_directory(path):
+    """Flush a directory entry so a rename inside it survives a crash"""
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path, text):
+    """Write a file via a fsynced temporary file and an atomic rename"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(text.encode())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_directory(os.path.dirname(path))
+
+
+def _atomic_save_arrays(path, arrays):
+    """Write arrays as an .npz file via a fsynced temporary file and an atomic rename; returns its size"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    _fsync_directory(os.path.dirname(path))
+    return size
+
+
+class MarketStore:
+    """Append-only tick/event log with periodic snapshots of the full market state.
+
+    Every record gets an increasing sequence number and is written as one compact
+    JSON line to ``<name>.log``. A snapshot is the full state plus the sequence
+    number it covers; after a snapshot is written the log is compacted down to the
+    records that came after it. Loading is the latest snapshot plus the log tail.
+    State better kept as arrays than JSON is saved with each snapshot in
+    ``<name>.arrays.npz``, tagged with the same sequence number.
+
+    Several processes may share the same files: writes happen inside ``locked()``,
+    which also takes an exclusive flock on ``<name>.lock``, and ``changed_on_disk``
+    tells a process when another one has written since it last looked.
+    """
+
+    def __init__(self, snapshot_file, snapshot_interval=100):
+        self.snapshot_file = snapshot_file
+        self.log_file = os.path.splitext(snapshot_file)[0] + ".log"
+        self.lock_file = os.path.splitext(snapshot_file)[0] + ".lock"
+        self.schedule_file = os.path.splitext(snapshot_file)[0] + ".schedule.json"
+        self.arrays_file = os.path.splitext(snapshot_file)[0] + ".arrays.npz"
+        self.snapshot_interval = snapshot_interval
+        self.seq = 0
+        self.snapshot_seq = 0
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_fd = None
+        self._compactor = None
+        self._log_offset = 0
+        self._seen_files = (None, None)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the store exclusively against other threads and other processes"""
+        with self._lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_fd is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                    os.close(self._lock_fd)
+                    self._lock_fd = None
+
+    def changed_on_disk(self):
+        """Whether the log or snapshot has been written by someone else since we last looked"""
+        return self._file_ids() != self._seen_files
+
+    def load_snapshot(self):
+        """Return the latest snapshot, or None if nothing has been saved yet"""
+        self.snapshot_seq = self.seq = 0
+        if not os.path.exists(self.snapshot_file):
+            return None
+        with open(self.snapshot_file, 'r') as f:
+            data = json.load(f)
+        self.snapshot_seq = self.seq = data.get("seq", 0)
+        return data
+
+    def load_arrays(self):
+        """Return the arrays saved with the loaded snapshot, or None if there are none for it"""
+        if not os.path.exists(self.snapshot_file):
+            return None
+        try:
+            with np.load(self.arrays_file, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError, zipfile.BadZipFile):
+            return None
+        # Arrays from a snapshot that was then not written, or was since replaced, do not apply
+        return arrays if int(arrays.pop("seq", -1)) == self.snapshot_seq else None
+
+    def load_schedule(self):
+        """Return the saved tick schedule, or None if there is none"""
+        try:
+            with open(self.schedule_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_schedule(self, schedule):
+        _atomic_write(self.schedule_file, json.dumps(schedule))
+
+    def read_log(self):
+        """Return the log records written after the loaded snapshot"""
+        records, valid_bytes = self._read_records(0)
+        if os.path.exists(self.log_file) and valid_bytes != os.path.getsize(self.log_file):
+            # Drop a write torn by a crash so later appends start on a clean line
+            with open(self.log_file, 'r+b') as f:
+                f.truncate(valid_bytes)
+                os.fsync(f.fileno())
+        records = [record for record in records if record["seq"] > self.seq]
+        if records:
+            self.seq = records[-1]["seq"]
+        self._log_offset = valid_bytes
+        self._seen_files = self._file_ids()
+        return records
+
+    def read_new_records(self):
+        """Records other processes logged since we last looked, or None if some were compacted away"""
+        log_id, snapshot_id = self._file_ids()
+        offset = self._log_offset if log_id is not None and log_id[1] >= self._log_offset else 0
+        records, valid_bytes = self._read_records(offset)
+        if offset and not (records and records[0]["seq"] == self.seq + 1):
+            # The log was compacted and replaced since we last read it
+            offset = 0
+            records, valid_bytes = self._read_records(0)
+        records = [record for record in records if record["seq"] > self.seq]
+
+        if records and records[0]["seq"] != self.seq + 1:
+            return None
+        if not records and snapshot_id != self._seen_files[1] and self._peek_snapshot_seq() > self.seq:
+            return None
+
+        if records:
+            self.seq = records[-1]["seq"]
+        self._log_offset = offset + valid_bytes
+        self._seen_files = self._file_ids()
+        return records
+
+    def append(self, records):
+        """Durably append records to the log with a single fsync"""
+        with self.locked():
+            lines = []
+            for record in records:
+                self.seq += 1
+                record["seq"] = self.seq
+                lines.append(json.dumps(record, separators=(",", ":")))
+            data = ("\n".join(lines) + "\n").encode()
+            with open(self.log_file, 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            PERSISTED_BYTES.inc(len(data), "log")
+            self._log_offset += len(data)
+            self._seen_files = self._file_ids()
+            return self.seq
+
+    def needs_snapshot(self):
+        """Whether enough records have piled up since the last snapshot"""
+        compacting = self._compactor is not None and self._compactor.is_alive()
+        return not compacting and self.seq - self.snapshot_seq >= self.snapshot_interval
+
+    def write_snapshot(self, build_state, background=False, build_arrays=None):
+        """Persist the state returned by ``build_state`` (and the arrays dict returned by
+        ``build_arrays``) as of the current sequence number, then compact the log behind
+        it. Both must only read immutable data when the snapshot is written in the
+        background."""
+        seq = self.seq
+        if not background:
+            self._snapshot_and_compact(build_state, seq, build_arrays)
+            return
+
+        self._compactor = threading.Thread(target=self._snapshot_and_compact, args=(build_state, seq, build_arrays),
+                                           daemon=True)
+        self._compactor.start()
+
+    def wait(self):
+        """Block until any background snapshot has finished"""
+        if self._compactor is not None:
+            self._compactor.join()
+
+    def _snapshot_and_compact(self, build_state, seq, build_arrays=None):
+        text = json.dumps(dict(build_state(), seq=seq), separators=(",", ":"))
+        arrays = dict(build_arrays(), seq=np.array(seq)) if build_arrays else None
+
+        with self.locked():
+            # If another process has written since, leave its changes flagged for sync()
+            up_to_date = not self.changed_on_disk()
+            if up_to_date or self._peek_snapshot_seq() <= seq:
+                if arrays is not None:
+                    PERSISTED_BYTES.inc(_atomic_save_arrays(self.arrays_file, arrays), "arrays")
+                _atomic_write(self.snapshot_file, text)
+                PERSISTED_BYTES.inc(len(text), "snapshot")
+            self.snapshot_seq = max(self.snapshot_seq, seq)
+            tail = []
+            if os.path.exists(self.log_file):
+                with open(self.log_file, 'rb') as f:
+                    tail = [line for line in f if json.loads(line)["seq"] > seq]
+                _atomic_write(self.log_file, b"".join(tail).decode())
+            if up_to_date:
+                self._log_offset = sum(len(line) for line in tail)
+                self._seen_files = self._file_ids()
+
+    def _read_records(self, offset):
+        """Parse complete log lines from ``offset``; returns the records and the bytes they span"""
+        if not os.path.exists(self.log_file):
+            return [], 0
+
+        records = []
+        valid_bytes = 0
+        with open(self.log_file, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                # A line without its newline is a write torn by a crash
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not isinstance(record, dict):
+                    break
+                valid_bytes += len(line)
+                records.append(record)
+        return records, valid_bytes
+
+    def _peek_snapshot_seq(self):
+        if not os.path.exists(self.snapshot_file):
+            return 0
+        with open(self.snapshot_file, 'r') as f:
+            return json.load(f).get("seq", 0)
+
+    def _file_ids(self):
+        ids = []
+        for path in (self.log_file, self.snapshot_file):
+            try:
+                st = os.stat(path)
+                ids.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except FileNotFoundError:
+                ids.append(None)
+        return tuple(ids)
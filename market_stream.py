@@ -0,0 +1,123 @@
+import json
+import threading
+from collections import deque
+
+import numpy as np
+
+# Recent deltas kept for clients resuming with Last-Event-ID, fewer for large worlds
+JOURNAL_SIZE = 1024
+JOURNAL_BYTES = 64 * 1024 * 1024
+
+
+def _encode_default(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def sse_message(event, data, event_id=None):
+    """One Server-Sent Events message"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":"), default=_encode_default))
+    return "\n".join(lines) + "\n\n"
+
+
+def _data_bytes(data):
+    """Approximate bytes of a delta's payload: the price arrays it carries"""
+    return sum(value.nbytes for value in data.values() if isinstance(value, np.ndarray))
+
+
+def journal_size(cells):
+    """How many whole-market tick deltas of ``cells`` prices fit the journal's memory budget"""
+    return max(16, min(JOURNAL_SIZE, JOURNAL_BYTES // (8 * max(cells, 1))))
+
+
+class DeltaJournal:
+    """The changes made by the most recent market versions, shared by every stream client.
+
+    The simulator publishes one delta per logged tick or event. Each delta is encoded
+    as an SSE message at most once, however many clients read it, and clients block
+    on a single condition instead of each having a queue fed by the writer.
+    ``nbytes`` approximates the memory held by the deltas' price arrays and encoded
+    messages.
+    """
+
+    def __init__(self, size=JOURNAL_SIZE):
+        self._entries = deque(maxlen=size)  # [version, event, data, encoded message, bytes or None once dropped]
+        self._base = 0                      # deltas after this version are all in the journal
+        self._latest = 0
+        self._nbytes = 0
+        self._condition = threading.Condition()
+
+    @property
+    def latest(self):
+        return self._latest
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def publish(self, version, event, data):
+        with self._condition:
+            if len(self._entries) == self._entries.maxlen:
+                self._base = self._entries[0][0]
+                self._drop(self._entries[0])
+            data = dict(data, version=version)
+            size = _data_bytes(data)
+            self._entries.append([version, event, data, None, size])
+            self._nbytes += size
+            self._latest = version
+            self._condition.notify_all()
+
+    def reset(self, version):
+        """Forget every delta; clients behind ``version`` must reload the full state"""
+        with self._condition:
+            for entry in self._entries:
+                self._drop(entry)
+            self._entries.clear()
+            self._base = self._latest = version
+            self._condition.notify_all()
+
+    def _drop(self, entry):
+        self._nbytes -= entry[4]
+        entry[4] = None
+
+    def since(self, version):
+        """``(version, message)`` pairs for every delta after ``version``, or None if some were dropped"""
+        with self._condition:
+            if version < self._base or version > self._latest:
+                return None
+            entries = [entry for entry in self._entries if entry[0] > version]
+        for entry in entries:
+            if entry[3] is None:
+                message = sse_message(entry[1], entry[2], entry[0])
+                with self._condition:
+                    # Count the message once, and not at all if the delta was dropped meanwhile
+                    if entry[3] is None and entry[4] is not None:
+                        entry[4] += len(message)
+                        self._nbytes += len(message)
+                    entry[3] = message
+        return [(entry[0], entry[3]) for entry in entries]
+
+    def entries(self, since, until):
+        """``(version, event, data)`` for the deltas after ``since`` up to ``until``, or None if some were dropped"""
+        with self._condition:
+            if since < self._base or since > self._latest:
+                return None
+            return [(entry[0], entry[1], entry[2]) for entry in self._entries if since < entry[0] <= until]
+
+    def version_of_day(self, day):
+        """Version of the tick that reached ``day``, or None if it is no longer in the journal"""
+        with self._condition:
+            for version, event, data, _, _ in self._entries:
+                if event == "tick" and data["day"] == day:
+                    return version
+        return None
+
+    def wait(self, version, timeout=None):
+        """Block until a delta newer than ``version`` is published; False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._latest != version, timeout)
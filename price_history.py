@@ -0,0 +1,165 @@
+import numpy as np
+
+
+class HistoryReader:
+    """Read-only access to the price history of every region x commodity cell.
+
+    A cell's values are the ``length`` entries of its row in the buffer ending at
+    ``end``. Days are only ever appended after ``end``, so a reader holding its own
+    copy of ``end`` and ``length`` keeps seeing the same values however many more
+    days are written afterwards. Events revise a cell's last entry in place, so a
+    frozen reader also keeps its own copy of every cell's last value.
+    """
+
+    __slots__ = ("capacity", "_buffer", "_end", "_length", "_rows", "_cols", "_last")
+
+    def __init__(self, capacity, buffer, end, length, rows, cols, last=None):
+        self.capacity = capacity
+        self._buffer = buffer
+        self._end = end
+        self._length = length
+        self._rows = rows
+        self._cols = cols
+        self._last = last
+
+    def __len__(self):
+        return int(self._length.max(initial=0))
+
+    @property
+    def lengths(self):
+        return self._length
+
+    @property
+    def nbytes(self):
+        last = self._last.nbytes if self._last is not None else 0
+        return self._buffer.nbytes + self._end.nbytes + self._length.nbytes + last
+
+    def cell(self, i, j):
+        """Read-only view of one cell's history, oldest first.
+
+        A copy only if the cell's last value has been revised since the reader was frozen.
+        """
+        end = self._end[i, j]
+        view = self._buffer[i, j, end - self._length[i, j]:end]
+        if self._last is not None and len(view) and view[-1] != self._last[i, j]:
+            view = view.copy()
+            view[-1] = self._last[i, j]
+        view.flags.writeable = False
+        return view
+
+    def last(self, back=1, rows=None, cols=None):
+        """Value ``back`` entries from the end of every cell, or of the cells at (rows, cols).
+
+        Only meaningful where the cell holds at least ``back`` values.
+        """
+        if rows is None:
+            rows, cols = self._rows, self._cols
+        if back == 1 and self._last is not None:
+            return self._last[rows, cols]
+        return self._buffer[rows, cols, np.maximum(self._end[rows, cols] - back, 0)]
+
+    def window(self, n):
+        """The last ``n`` values of every cell, oldest first, with a mask of which slots are filled"""
+        offsets = np.arange(n)
+        positions = np.maximum(self._end[..., np.newaxis] - n + offsets, 0)
+        values = np.take_along_axis(self._buffer, positions, axis=2)
+        if self._last is not None and n:
+            values[..., -1] = self._last
+        filled = offsets >= n - np.minimum(self._length, n)[..., np.newaxis]
+        return np.where(filled, values, 0.0), filled
+
+
+class PriceHistory(HistoryReader):
+    """Bounded price history for every region x commodity cell in one float64 array.
+
+    Each cell's row has room for twice the retention. Values are appended after the
+    cell's last entry; once any row is full the most recent ``capacity`` values of
+    every cell are copied into a fresh buffer, which costs O(1) amortized per value.
+    A cell's history is therefore always one contiguous slice that can be handed out
+    as a view, and ``freeze`` is a cheap immutable snapshot for concurrent readers.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, shape, capacity=30):
+        rows, cols = np.indices(shape)
+        super().__init__(capacity, np.zeros(shape + (2 * capacity,)),
+                         np.zeros(shape, dtype=np.intp), np.zeros(shape, dtype=np.intp), rows, cols)
+
+    def freeze(self):
+        """Snapshot of the history as it is now, unaffected by later appends and revisions"""
+        return HistoryReader(self.capacity, self._buffer, self._end.copy(), self._length.copy(),
+                             self._rows, self._cols, self.last())
+
+    def set_cell(self, i, j, values):
+        """Replace one cell's history, keeping the most recent ``capacity`` values"""
+        values = np.asarray(values, dtype=float)[-self.capacity:]
+        n = len(values)
+        if self._end[i, j] + n > self._buffer.shape[2]:
+            self._compact()
+        start = self._end[i, j]
+        self._buffer[i, j, start:start + n] = values
+        self._end[i, j] = start + n
+        self._length[i, j] = n
+
+    def append(self, values, rows=None, cols=None):
+        """Append one value to every cell, or to each of the cells at (rows, cols)"""
+        if rows is None:
+            rows, cols = self._rows, self._cols
+        self._write(np.asarray(rows), np.asarray(cols), np.asarray(values, dtype=float))
+
+    def revise_last(self, values, rows, cols):
+        """Replace the last value of each of the (non-empty) cells at (rows, cols) in place.
+
+        Frozen readers keep their own copy of the values this overwrites.
+        """
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        self._buffer[rows, cols, self._end[rows, cols] - 1] = values
+
+    def _write(self, rows, cols, values):
+        if (self._end[rows, cols] == self._buffer.shape[2]).any():
+            self._compact()
+        end = self._end[rows, cols]
+        self._buffer[rows, cols, end] = values
+        self._end[rows, cols] = end + 1
+        self._length[rows, cols] = np.minimum(self._length[rows, cols] + 1, self.capacity)
+
+    def _compact(self):
+        """Move every cell's retained values to the front of a new buffer"""
+        values, filled = self.window(self.capacity)
+        buffer = np.zeros_like(self._buffer)
+        # Right-aligned windows become left-aligned rows: shift each cell by its empty slots
+        shift = self.capacity - self._length
+        positions = (np.arange(self.capacity) + shift[..., np.newaxis]) % self.capacity
+        buffer[..., :self.capacity] = np.take_along_axis(values, positions, axis=2)
+        self._buffer = buffer
+        self._end = self._length.copy()
+
+
+class MarketCell:
+    """Dict-style view of one region x commodity cell backed by the simulator's arrays"""
+
+    __slots__ = ("_sim", "_i", "_j")
+
+    def __init__(self, sim, i, j):
+        self._sim = sim
+        self._i = i
+        self._j = j
+
+    @property
+    def current_price(self):
+        return float(self._sim.prices[self._i, self._j])
+
+    @property
+    def history(self):
+        return self._sim.history.cell(self._i, self._j)
+
+    def __getitem__(self, key):
+        if key == "current_price":
+            return self.current_price
+        if key == "history":
+            return self.history
+        raise KeyError(key)
+
+    def to_dict(self):
+        return {"current_price": self.current_price, "history": self.history.tolist()}
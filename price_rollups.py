@@ -0,0 +1,193 @@
+import math
+
+import numpy as np
+
+# Rollup tiers: name, days per bucket and completed buckets kept (None keeps as many days as the raw history)
+TIERS = (("daily", 1, None), ("weekly", 7, 52), ("monthly", 30, 36))
+RESOLUTIONS = ("raw",) + tuple(name for name, _, _ in TIERS)
+
+# Per bucket and cell: open, high, low, close, sum and count of the prices observed in it
+OPEN, HIGH, LOW, CLOSE, SUM, COUNT = range(6)
+
+
+class RollupReader:
+    """Read-only OHLC buckets of one rollup tier for every region x commodity cell.
+
+    The last ``slots`` completed buckets sit in a ring with one spare entry, written
+    in place as the tier moves on. A reader keeps the count of buckets completed
+    when it was frozen and checks the live count after reading, dropping any bucket
+    the ring has since overwritten or may be overwriting. The bucket in progress is
+    a tuple of per-field arrays, with the high and low of all but its latest price,
+    that the writer replaces rather than mutates, so holding the tuple freezes it.
+    """
+
+    __slots__ = ("name", "bucket_days", "slots", "_ring", "_ring_buckets", "_completed", "_current", "_tier")
+
+    def __init__(self, name, bucket_days, slots, ring, ring_buckets, completed, current, tier):
+        self.name = name
+        self.bucket_days = bucket_days
+        self.slots = slots
+        self._ring = ring
+        self._ring_buckets = ring_buckets
+        self._completed = completed
+        self._current = current
+        self._tier = tier
+
+    @property
+    def nbytes(self):
+        _, fields, before = self._current
+        return self._ring.nbytes + sum(field.nbytes for field in fields + before)
+
+    def _read_completed(self, index):
+        """Fields of the completed buckets at ``index`` of the ring (oldest first) and their bucket numbers"""
+        n = min(self._completed, self.slots)
+        positions = np.arange(self._completed - n, self._completed) % len(self._ring_buckets)
+        values = self._ring[index + (positions,)]
+        buckets = self._ring_buckets[positions]
+        # The writer may since have completed buckets over our oldest ones, and may be writing the next
+        overwritten = max(self._tier._completed + 1 - len(self._ring_buckets) - (self._completed - n), 0)
+        return values[..., overwritten:, :], buckets[overwritten:]
+
+    def buckets(self, i, j):
+        """(first day, open, high, low, close, mean, count) of each bucket of one cell, oldest first"""
+        values, buckets = self._read_completed((i, j))
+        bucket, fields, _ = self._current
+        if bucket is not None:
+            values = np.vstack([values, [field[i, j] for field in fields]])
+            buckets = np.append(buckets, bucket)
+        rows = []
+        for first, value in zip(buckets.tolist(), values.tolist()):
+            rows.append((first * self.bucket_days, value[OPEN], value[HIGH], value[LOW], value[CLOSE],
+                         value[SUM] / value[COUNT], int(value[COUNT])))
+        return rows
+
+    def to_arrays(self):
+        """The tier as plain arrays, oldest completed bucket first, for persisting next to a snapshot"""
+        ring, buckets = self._read_completed((slice(None), slice(None)))
+        bucket, fields, before = self._current
+        return {
+            f"{self.name}_ring": ring,
+            f"{self.name}_buckets": buckets,
+            f"{self.name}_current": np.stack(fields + before, axis=-1) if bucket is not None else np.zeros(0),
+            f"{self.name}_current_bucket": np.array(-1 if bucket is None else bucket)
+        }
+
+
+class RollupTier(RollupReader):
+    """OHLC and mean of every cell's prices per bucket of ``bucket_days`` market days, updated per tick"""
+
+    __slots__ = ()
+
+    def __init__(self, name, shape, bucket_days, slots):
+        super().__init__(name, bucket_days, slots, np.zeros(shape + (slots + 1, 6)),
+                         np.zeros(slots + 1, dtype=np.int64), 0, (None, (), ()), None)
+        self._tier = self
+
+    def freeze(self):
+        return RollupReader(self.name, self.bucket_days, self.slots, self._ring, self._ring_buckets,
+                            self._completed, self._current, self)
+
+    def observe(self, day, values):
+        """Fold market ``day``'s prices into every cell"""
+        bucket = day // self.bucket_days
+        current, fields, _ = self._current
+        if bucket != current:
+            if current is not None:
+                self._complete()
+            close = values.copy()
+            self._current = (bucket, (close, close, close, close, close, np.ones(values.shape)),
+                             (np.full(values.shape, -np.inf), np.full(values.shape, np.inf)))
+            return
+        self._current = (bucket, (fields[OPEN], np.maximum(fields[HIGH], values), np.minimum(fields[LOW], values),
+                                  values.copy(), fields[SUM] + values, fields[COUNT] + 1),
+                         (fields[HIGH], fields[LOW]))
+
+    def revise(self, values, rows, cols):
+        """Replace the latest price folded into the cells at (rows, cols), as an event moving today's price"""
+        bucket, fields, before = self._current
+        if bucket is None:
+            return
+        fields = tuple(field.copy() for field in fields)
+        high, low = before
+        fields[OPEN][rows, cols] = np.where(fields[COUNT][rows, cols] == 1, values, fields[OPEN][rows, cols])
+        fields[HIGH][rows, cols] = np.maximum(high[rows, cols], values)
+        fields[LOW][rows, cols] = np.minimum(low[rows, cols], values)
+        fields[SUM][rows, cols] += values - fields[CLOSE][rows, cols]
+        fields[CLOSE][rows, cols] = values
+        self._current = (bucket, fields, before)
+
+    def _complete(self):
+        """Move the bucket in progress into the ring of completed buckets"""
+        bucket, fields, _ = self._current
+        position = self._completed % len(self._ring_buckets)
+        self._ring[..., position, :] = np.stack(fields, axis=-1)
+        self._ring_buckets[position] = bucket
+        self._completed += 1
+
+    def load_arrays(self, arrays):
+        """Restore the tier from ``to_arrays`` output; returns False if it does not fit this tier"""
+        try:
+            ring = arrays[f"{self.name}_ring"]
+            buckets = arrays[f"{self.name}_buckets"]
+            current = arrays[f"{self.name}_current"]
+            bucket = int(arrays[f"{self.name}_current_bucket"])
+        except KeyError:
+            return False
+        if ring.shape[:2] != self._ring.shape[:2] or (bucket >= 0 and current.shape[-1] != 8):
+            return False
+        n = min(ring.shape[2], self.slots)
+        self._ring[..., :n, :] = ring[..., ring.shape[2] - n:, :]
+        self._ring_buckets[:n] = buckets[len(buckets) - n:]
+        self._completed = n
+        if bucket < 0:
+            self._current = (None, (), ())
+        else:
+            fields = tuple(current[..., k].copy() for k in range(8))
+            self._current = (bucket, fields[:6], fields[6:])
+        return True
+
+
+def rollup_tiers(shape, history_days):
+    return [RollupTier(name, shape, bucket_days, slots or history_days) for name, bucket_days, slots in TIERS]
+
+
+def merge_buckets(rows, max_points):
+    """Merge runs of consecutive buckets so at most ``max_points`` remain, keeping their OHLC exact"""
+    if len(rows) <= max_points:
+        return rows
+    size = math.ceil(len(rows) / max_points)
+    merged = []
+    for start in range(0, len(rows), size):
+        group = rows[start:start + size]
+        count = sum(row[6] for row in group)
+        merged.append((group[0][0], group[0][1], max(row[2] for row in group), min(row[3] for row in group),
+                       group[-1][4], sum(row[5] * row[6] for row in group) / count, count))
+    return merged
+
+
+def lttb(values, max_points):
+    """Indices of at most ``max_points`` values chosen by Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last point and, from each of the equal buckets in between,
+    the point forming the largest triangle with the previously kept point and the
+    average of the next bucket, which preserves peaks and troughs of the series.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    max_points = max(max_points, 3)
+    if n <= max_points:
+        return np.arange(n)
+
+    every = (n - 2) / (max_points - 2)
+    kept = [0]
+    for b in range(max_points - 2):
+        start, stop = int(b * every) + 1, int((b + 1) * every) + 1
+        next_stop = min(int((b + 2) * every) + 1, n)
+        next_x = (stop + next_stop - 1) / 2
+        next_y = values[stop:next_stop].mean()
+        a = kept[-1]
+        x = np.arange(start, stop)
+        areas = np.abs((a - next_x) * (values[start:stop] - values[a]) - (a - x) * (next_y - values[a]))
+        kept.append(start + int(areas.argmax()))
+    kept.append(n - 1)
+    return np.array(kept)
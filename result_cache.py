@@ -0,0 +1,111 @@
+import functools
+import threading
+from collections import OrderedDict
+
+
+class VersionedCache:
+    """Bounded LRU cache of computed results keyed by market version and arguments.
+
+    Versions only go up, so entries for older versions are dropped as soon as a newer
+    one is seen, and results computed for an older version are not stored. Besides
+    ``maxsize`` entries, serialized results (bytes or str) are bounded by ``maxbytes``
+    in total; one larger than that on its own is returned without being cached.
+    """
+
+    def __init__(self, maxsize=256, maxbytes=64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._latest = None
+        self._entries = OrderedDict()   # (version,) + key -> (result, size)
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, version, key, compute):
+        """Return the cached result for (version, key), computing and storing it on a miss"""
+        cache_key = (version,) + key
+        with self._lock:
+            self._advance(version)
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return self._entries[cache_key][0]
+            self.misses += 1
+
+        result = compute()
+
+        size = len(result) if isinstance(result, (bytes, str)) else 0
+        with self._lock:
+            self._advance(version)
+            if version < self._latest or size > self.maxbytes:
+                return result
+            previous = self._entries.pop(cache_key, None)
+            if previous is not None:
+                self.nbytes -= previous[1]
+            self._entries[cache_key] = (result, size)
+            self.nbytes += size
+            while len(self._entries) > self.maxsize or self.nbytes > self.maxbytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+        return result
+
+    def _advance(self, version):
+        """Drop every entry older than ``version`` the first time it is seen"""
+        if self._latest is not None and version <= self._latest:
+            return
+        self._latest = version
+        for cache_key in [cache_key for cache_key in self._entries if cache_key[0] < version]:
+            self.nbytes -= self._entries.pop(cache_key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+class FragmentCache:
+    """Latest rendering of each page fragment, tagged with the version of the data it shows.
+
+    Unlike VersionedCache an entry survives new market versions: it is only
+    re-rendered when asked for with a newer stamp, such as the version at which
+    its region last changed. One entry is kept per fragment key.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, stamp, render):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        result = render()
+
+        with self._lock:
+            # A reader of an older snapshot must not replace a newer rendering
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= stamp:
+                self.nbytes += len(result) - (len(entry[1]) if entry is not None else 0)
+                self._entries[key] = (stamp, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+def versioned(method):
+    """Memoize a MarketSimulator method per market version and argument tuple"""
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        return self.result_cache.get_or_compute(self.version, (method.__name__,) + args,
+                                                lambda: method(self, *args))
+    return wrapper
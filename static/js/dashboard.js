@@ -19,7 +19,7 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     // Form validation enhancement
-    const forms = document.querySelectorAll('form');
+    const forms = document.querySelectorAll('form:not([data-async])');
     forms.forEach(form => {
         form.addEventListener('submit', function(e) {
             // Add loading state to submit buttons
@@ -51,6 +51,102 @@ document.addEventListener('DOMContentLoaded', function() {
     // Update timestamp on page load
     updateTimestamp();
 
+    // Forms marked data-async post in the background; the market stream shows the result
+    document.querySelectorAll('form[data-async]').forEach(form => {
+        form.addEventListener('submit', function(e) {
+            e.preventDefault();
+            const submitBtn = form.querySelector('button[type="submit"]');
+            const originalText = submitBtn ? submitBtn.innerHTML : null;
+            if (submitBtn) {
+                submitBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Processing...';
+                submitBtn.disabled = true;
+            }
+            fetch(form.action, {method: 'POST', body: new FormData(form), headers: {'Accept': 'application/json'}})
+                .then(response => {
+                    if (!response.ok) {
+                        return response.json().then(body => { throw new Error(body.error || body.message); });
+                    }
+                })
+                .catch(error => window.alert(error.message))
+                .finally(() => {
+                    if (submitBtn) {
+                        submitBtn.innerHTML = originalText;
+                        submitBtn.disabled = false;
+                    }
+                });
+        });
+    });
+
+    // Rows below the fold: a placeholder marked data-lazy-url fetches the next page of rendered
+    // rows when it scrolls near the viewport, and moves on to the page after that
+    document.querySelectorAll('[data-lazy-url]').forEach(placeholder => {
+        let loading = false;
+        const observer = new IntersectionObserver(entries => {
+            if (loading || !entries.some(entry => entry.isIntersecting)) return;
+            loading = true;
+            fetch(placeholder.dataset.lazyUrl, {headers: {'Accept': 'application/json'}})
+                .then(response => response.json())
+                .then(page => {
+                    placeholder.insertAdjacentHTML('beforebegin', page.html);
+                    if (page.next) {
+                        placeholder.dataset.lazyUrl = page.next;
+                        // Re-observe so a placeholder still in view triggers the next page
+                        observer.unobserve(placeholder);
+                        observer.observe(placeholder);
+                    } else {
+                        observer.disconnect();
+                        placeholder.remove();
+                    }
+                })
+                .finally(() => { loading = false; });
+        }, {rootMargin: '400px'});
+        observer.observe(placeholder);
+    });
+
+    // Live prices: cells marked with data-region/data-commodity follow the market stream
+    const streamRoot = document.querySelector('[data-stream-url]');
+    if (streamRoot && window.MarketStream) {
+        MarketStream.on('tick', delta => updatePriceCells(delta, false));
+        MarketStream.on('event', delta => updatePriceCells(delta, true));
+        MarketStream.on('event', delta => {
+            const card = document.querySelector(`[data-event-region="${CSS.escape(delta.region)}"]`);
+            if (card) {
+                card.classList.replace('bg-white', 'bg-light');
+                const text = card.querySelector('p');
+                text.textContent = delta.description;
+            }
+        });
+        MarketStream.on('reset', () => window.location.reload());
+        MarketStream.start(streamRoot.dataset.streamUrl);
+    }
+
+    // Changes are day over day, as the server renders them: a tick makes the shown price the
+    // previous day's, while an event only revises today's price against the same previous day
+    function updatePriceCells(delta, revise) {
+        document.querySelectorAll('[data-region][data-commodity]').forEach(cell => {
+            const price = delta.priceOf(cell.dataset.region, cell.dataset.commodity);
+            if (price === undefined) return;
+
+            if (!revise) {
+                cell.dataset.previous = cell.dataset.price;
+            }
+            cell.dataset.price = price;
+            cell.querySelector('.price-number').textContent = price.toFixed(2);
+            if (cell.dataset.previous === undefined) return;
+            const change = DashboardUtils.calculatePercentageChange(parseFloat(cell.dataset.previous), price);
+
+            let indicator = cell.querySelector('.price-change');
+            if (!indicator) {
+                indicator = document.createElement('small');
+                cell.appendChild(indicator);
+            }
+            const direction = change > 2 ? 'arrow-up' : change < -2 ? 'arrow-down' : 'minus';
+            indicator.className = `price-change ${change > 2 ? 'text-success' : change < -2 ? 'text-danger' : 'text-muted'}`;
+            indicator.innerHTML = `<i class="fas fa-${direction}"></i> ${Math.abs(change).toFixed(1)}%`;
+        });
+        updateTimestamp();
+    }
+
     // Alert auto-dismiss
     const alerts = document.querySelectorAll('.alert');
     alerts.forEach(alert => {
@@ -101,4 +197,53 @@ if (!window.DashboardUtils) {
         calculatePercentageChange,
         addTrendIndicator
     };
+}
+
+// Server-Sent Events client for /api/stream, shared by every page script
+if (!window.MarketStream) {
+    const listeners = {};
+    let source = null;
+    let world = null;
+
+    const on = (type, callback) => {
+        (listeners[type] = listeners[type] || []).push(callback);
+    };
+
+    const dispatch = (type, delta) => {
+        (listeners[type] || []).forEach(callback => callback(delta));
+    };
+
+    const start = (url) => {
+        if (source) return source;
+        source = new EventSource(url);
+
+        source.addEventListener('world', e => {
+            const data = JSON.parse(e.data);
+            world = {
+                regions: Object.fromEntries(data.regions.map((region, i) => [region, i])),
+                commodities: Object.fromEntries(data.commodities.map((commodity, j) => [commodity, j]))
+            };
+        });
+
+        // Ticks carry every price as a regions x commodities array, events only the cells they moved
+        source.addEventListener('tick', e => {
+            const delta = JSON.parse(e.data);
+            delta.priceOf = (region, commodity) => {
+                const i = world.regions[region], j = world.commodities[commodity];
+                return i === undefined || j === undefined ? undefined : delta.prices[i][j];
+            };
+            dispatch('tick', delta);
+        });
+
+        source.addEventListener('event', e => {
+            const delta = JSON.parse(e.data);
+            delta.priceOf = (region, commodity) => region === delta.region ? delta.prices[commodity] : undefined;
+            dispatch('event', delta);
+        });
+
+        source.addEventListener('reset', e => dispatch('reset', JSON.parse(e.data)));
+        return source;
+    };
+
+    window.MarketStream = { on, start };
 }
\ No newline at end of file
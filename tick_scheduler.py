@@ -0,0 +1,141 @@
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TickScheduler:
+    """Advances a market one day every ``day_seconds`` of real time from a background thread.
+
+    The schedule is anchored to the wall clock: day ``anchor_day`` was due at
+    ``anchor_time``, and every ``day_seconds`` after it another day is due. The
+    anchor and the paused flag are saved next to the market files, so after a
+    restart the market catches up every day it missed in one batched advance and a
+    single save. Days advanced by hand count towards the schedule, and the advance
+    runs under the market's write locks, so no day is ever applied twice; several
+    processes sharing the state files may each run a scheduler. A catch-up longer
+    than ``max_catch_up`` days skips the excess instead of simulating it.
+    """
+
+    def __init__(self, sim, day_seconds, max_catch_up=365):
+        if day_seconds <= 0:
+            raise ValueError("day_seconds must be positive")
+        self.sim = sim
+        self.day_seconds = day_seconds
+        self.max_catch_up = max_catch_up
+        self.last_catch_up = 0
+        self.last_run = None
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        """Catch up with the schedule and keep the market on it from a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="tick-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def pause(self):
+        """Stop advancing; the paused time is not caught up later"""
+        with self.sim.locked():
+            schedule = self._schedule()
+            if not schedule["paused"]:
+                self._save(self.sim.snapshot().day, time.time(), paused=True)
+        self._wake.set()
+
+    def resume(self):
+        """Start advancing again, one day_seconds from now"""
+        with self.sim.locked():
+            schedule = self._schedule()
+            if schedule["paused"]:
+                self._save(self.sim.snapshot().day, time.time(), paused=False)
+        self._wake.set()
+
+    def status(self):
+        schedule = self._schedule()
+        due_day = self._due_day(schedule, time.time())
+        day = self.sim.snapshot().day
+        return {
+            "paused": schedule["paused"],
+            "day_seconds": self.day_seconds,
+            "day": day,
+            "due_day": due_day,
+            "behind": max(due_day - day, 0),
+            "next_tick_in": None if schedule["paused"] else self._seconds_until_next(schedule, time.time()),
+            "last_catch_up": self.last_catch_up,
+            "last_run": self.last_run
+        }
+
+    def run_pending(self):
+        """Advance to the day due now in one batch; returns the number of days applied"""
+        with self.sim.locked():
+            schedule = self._schedule()
+            if schedule["paused"]:
+                return 0
+            now = time.time()
+            due_day = self._due_day(schedule, now)
+            self.sim.sync()
+            behind = due_day - self.sim.day
+            if self.max_catch_up is not None and behind > self.max_catch_up:
+                # Too long a gap to simulate: re-anchor so only the allowed days are applied
+                logger.warning("Market is %d days behind schedule; catching up only %d", behind, self.max_catch_up)
+                due_day = self.sim.day + self.max_catch_up
+                elapsed = math.floor((now - schedule["anchor_time"]) / self.day_seconds) * self.day_seconds
+                self._save(due_day, schedule["anchor_time"] + elapsed, paused=False)
+            days = self.sim.advance_to_day(due_day)
+
+        if days > 1:
+            # A catch-up is one batched advance; snapshot it so the next start loads it in one read
+            self.sim.save_market()
+        if days:
+            logger.info("Scheduler advanced the market %d day(s) to day %d", days, due_day)
+        self.last_catch_up = days
+        self.last_run = now
+        return days
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self.run_pending()
+                schedule = self._schedule()
+                # While paused, look again now and then in case another process resumed
+                wait = self.day_seconds if schedule["paused"] else self._seconds_until_next(schedule, time.time())
+            except Exception:
+                logger.exception("Scheduled tick failed")
+                wait = self.day_seconds
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def _schedule(self):
+        schedule = self.sim.store.load_schedule()
+        if schedule is None:
+            # First run: the current day is due now
+            with self.sim.locked():
+                schedule = self.sim.store.load_schedule()
+                if schedule is None:
+                    schedule = self._save(self.sim.snapshot().day, time.time(), paused=False)
+        return schedule
+
+    def _save(self, anchor_day, anchor_time, paused):
+        schedule = {"anchor_day": anchor_day, "anchor_time": anchor_time, "paused": paused}
+        self.sim.store.save_schedule(schedule)
+        return schedule
+
+    def _due_day(self, schedule, now):
+        if schedule["paused"]:
+            return schedule["anchor_day"]
+        return schedule["anchor_day"] + max(math.floor((now - schedule["anchor_time"]) / self.day_seconds), 0)
+
+    def _seconds_until_next(self, schedule, now):
+        elapsed = max(now - schedule["anchor_time"], 0)
+        return self.day_seconds - elapsed % self.day_seconds
@@ -0,0 +1,147 @@
+import heapq
+import math
+
+import numpy as np
+
+# Fraction of the cargo's value lost on a leg between two regions not listed in transport_costs
+DEFAULT_TRANSPORT_COST = 0.05
+
+MAX_HOPS = 5
+
+# Above this many candidate chains in one hop, the route search keeps only the best per end region
+MAX_EXACT_CANDIDATES = 1_000_000
+
+# Profit matrix entries top_trades works on at once (a 1000-region world is then four commodities a block)
+TOP_TRADES_BLOCK = 4_000_000
+
+
+def profit_matrix(prices):
+    """Profit percentage for buying in every region and selling in every other, per commodity.
+
+    ``prices`` is the regions x commodities price array. Entry [c, a, b] is the profit
+    percentage of buying commodity ``c`` in region ``a`` and selling it in region ``b``;
+    the diagonal (a region trading with itself) is -inf.
+    """
+    buy = prices.T[:, :, np.newaxis]
+    sell = prices.T[:, np.newaxis, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        matrix = np.where(buy > 0, (sell - buy) / buy * 100, 0.0)
+    matrix[:, np.arange(len(prices)), np.arange(len(prices))] = -np.inf
+    return matrix
+
+
+def top_trades(prices, k=10, block=TOP_TRADES_BLOCK):
+    """The ``k`` best (commodity, export, import, profit %) trades in a regions x commodities price array.
+
+    The profit matrix is built a block of commodities at a time, so at most ``block``
+    of its entries are held at once. argpartition narrows each block to its ``k``
+    best entries in linear time, and only those go through a running heap.
+    """
+    n_regions, n_commodities = prices.shape
+    step = max(1, block // max(n_regions * n_regions, 1))
+    best = []   # min-heap of the k best (profit %, commodity, export, import) so far
+    for start in range(0, n_commodities, step):
+        matrix = profit_matrix(prices[:, start:start + step])
+        flat = matrix.ravel()
+        m = min(k, np.count_nonzero(np.isfinite(flat)))
+        if m <= 0:
+            continue
+        candidates = np.argpartition(flat, -m)[-m:] if m < len(flat) else np.arange(len(flat))
+        for index in candidates.tolist():
+            j, i_export, i_import = np.unravel_index(index, matrix.shape)
+            trade = (float(flat[index]), start + int(j), int(i_export), int(i_import))
+            if len(best) < k:
+                heapq.heappush(best, trade)
+            else:
+                heapq.heappushpop(best, trade)
+    return [(j, i_export, i_import, profit) for profit, j, i_export, i_import in sorted(best, reverse=True)]
+
+
+def transport_matrix(regions, default_cost=DEFAULT_TRANSPORT_COST, transport_costs=None):
+    """Regions x regions cost fractions per leg, from ``{export: {import: cost}}`` overrides.
+
+    A cost of None in the overrides means there is no route between the two regions.
+    """
+    index = {region: i for i, region in enumerate(regions)}
+    costs = np.full((len(regions), len(regions)), float(default_cost))
+    for export_region, routes in (transport_costs or {}).items():
+        for import_region, cost in routes.items():
+            if export_region in index and import_region in index:
+                costs[index[export_region], index[import_region]] = np.inf if cost is None else cost
+    np.fill_diagonal(costs, np.inf)
+    return costs
+
+
+def best_routes(prices, costs, starts, max_hops=3, k=10):
+    """The ``k`` most profitable trade chains of 1 to ``max_hops`` legs, and whether they are exact.
+
+    On each leg the trader sells everything, pays the leg's transport cost and buys
+    whichever commodity gains most on the next leg, so a leg multiplies the purse by
+    ``max_c(sell / buy) * (1 - cost)``. Chains never revisit a region, so two chains
+    ending in the same region having visited the same regions can be extended in
+    exactly the same ways. Each hop therefore keeps the ``k`` best chains per end
+    region and visited set, which finds the true best chains. Once a hop would have
+    more than MAX_EXACT_CANDIDATES candidate chains, the search carries on from only
+    the ``k`` best chains per end region, and the result is approximate.
+
+    Returns ``(routes, exact)``: ``(gain, path, commodities)`` tuples, best first, where
+    ``path`` holds region indices and ``commodities`` the commodity index traded on
+    each leg, and False if any hop had to fall back to the approximate search.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.where(prices[:, np.newaxis, :] > 0, prices[np.newaxis, :, :] / prices[:, np.newaxis, :], 0.0)
+    leg_commodity = ratios.argmax(axis=2)
+    leg_gain = ratios.max(axis=2) * np.clip(1 - costs, 0, None)
+    leg_gain[~np.isfinite(costs)] = -np.inf
+
+    n_regions = len(prices)
+    gains = np.ones(len(starts))
+    paths = np.asarray(starts, dtype=np.intp)[:, np.newaxis]
+    found = []
+    exact = True
+
+    for hops in range(1, min(max_hops, MAX_HOPS, n_regions - 1) + 1):
+        if exact and len(paths) * n_regions > MAX_EXACT_CANDIDATES:
+            exact = False
+            kept = _best_per_state(gains, paths[:, -1:], k)
+            gains, paths = gains[kept], paths[kept]
+
+        candidates = gains[:, np.newaxis] * leg_gain[paths[:, -1]]
+        candidates[np.arange(len(paths))[:, np.newaxis], paths] = -np.inf
+
+        if exact:
+            rows, ends = np.nonzero(np.isfinite(candidates))
+            # A state holds at most one chain per order of its other regions; only prune if that can exceed k
+            if math.factorial(hops) > k:
+                states = np.column_stack([ends, np.sort(paths[rows], axis=1)])
+                kept = _best_per_state(candidates[rows, ends], states, k)
+                rows, ends = rows[kept], ends[kept]
+        else:
+            keep = min(k, len(paths))
+            rows = np.argpartition(-candidates, keep - 1, axis=0)[:keep] if keep < len(paths) else \
+                np.broadcast_to(np.arange(len(paths))[:, np.newaxis], candidates.shape)
+            rows = rows.ravel()
+            ends = np.tile(np.arange(n_regions), keep)
+            valid = np.isfinite(candidates[rows, ends])
+            rows, ends = rows[valid], ends[valid]
+        if not len(rows):
+            break
+
+        gains = candidates[rows, ends]
+        paths = np.hstack([paths[rows], ends[:, np.newaxis]])
+        # The overall best chains are among the best of each hop
+        top = np.argpartition(-gains, k - 1)[:k] if len(gains) > k else np.arange(len(gains))
+        found.extend(zip(gains[top].tolist(), map(tuple, paths[top].tolist())))
+
+    best = heapq.nlargest(k, found, key=lambda route: route[0])
+    return [(gain, path, [int(leg_commodity[a, b]) for a, b in zip(path, path[1:])]) for gain, path in best], exact
+
+
+def _best_per_state(gains, states, k):
+    """Indices of the ``k`` largest ``gains`` among the entries sharing each row of ``states``"""
+    order = np.lexsort((-gains,) + tuple(states.T[::-1]))
+    ordered = states[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+    position = np.arange(len(order))
+    return order[position - np.maximum.accumulate(np.where(first, position, 0)) < k]
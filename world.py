@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import zipfile
+from functools import cached_property
+
+import numpy as np
+
+WORLD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worlds")
+DEFAULT_WORLD_FILE = os.path.join(WORLD_DIR, "default.json")
+
+# Bump when the compiled layout changes so stale caches are ignored
+COMPILE_VERSION = 1
+
+_ARRAYS = ("regions", "commodity_names", "units", "base_prices", "volatilities",
+           "modifier_rows", "modifier_cols", "modifier_values",
+           "event_offsets", "event_descriptions", "effect_offsets", "effect_cols", "effect_values",
+           "transport_costs_json")
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+class WorldError(ValueError):
+    """A world definition that cannot be compiled"""
+
+
+class World:
+    """A world definition compiled into integer-indexed tables.
+
+    Regions and commodities are numbered in definition order. Regional modifiers
+    become a dense regions x commodities multiplier matrix, and each event becomes
+    a sparse effect vector: event ``k`` of region ``i`` is entry
+    ``event_offsets[i] + k``, whose effects are the ``effect_cols`` and
+    ``effect_values`` between consecutive ``effect_offsets``. The dict views the
+    pages and legacy code read are built from the tables on first use.
+    """
+
+    def __init__(self, arrays):
+        self.regions = [str(region) for region in arrays["regions"]]
+        self.commodity_names = [str(commodity) for commodity in arrays["commodity_names"]]
+        self.units = [str(unit) for unit in arrays["units"]]
+        self.base_prices = arrays["base_prices"]
+        self.volatilities = arrays["volatilities"]
+        self.modifier_rows = arrays["modifier_rows"]
+        self.modifier_cols = arrays["modifier_cols"]
+        self.modifier_values = arrays["modifier_values"]
+        self.event_offsets = arrays["event_offsets"]
+        self.event_descriptions = [str(description) for description in arrays["event_descriptions"]]
+        self.effect_offsets = arrays["effect_offsets"]
+        self.effect_cols = arrays["effect_cols"]
+        self.effect_values = arrays["effect_values"]
+        self.transport_costs = json.loads(str(arrays["transport_costs_json"]))
+        self._arrays = arrays
+
+        self.region_index = {region: i for i, region in enumerate(self.regions)}
+        self.commodity_index = {commodity: j for j, commodity in enumerate(self.commodity_names)}
+        self.modifier_matrix = np.ones((len(self.regions), len(self.commodity_names)))
+        self.modifier_matrix[self.modifier_rows, self.modifier_cols] += self.modifier_values
+
+    def event_count(self, i):
+        return int(self.event_offsets[i + 1] - self.event_offsets[i])
+
+    def event(self, i, k):
+        """Description, commodity indices and fractional price changes of region ``i``'s event ``k``"""
+        e = self.event_offsets[i] + k
+        start, stop = self.effect_offsets[e], self.effect_offsets[e + 1]
+        return self.event_descriptions[e], self.effect_cols[start:stop], self.effect_values[start:stop]
+
+    @cached_property
+    def commodities(self):
+        return {commodity: {"base_price": float(self.base_prices[j]), "unit": self.units[j],
+                            "volatility": float(self.volatilities[j])}
+                for j, commodity in enumerate(self.commodity_names)}
+
+    @cached_property
+    def region_modifiers(self):
+        modifiers = {region: {} for region in self.regions}
+        for i, j, value in zip(self.modifier_rows.tolist(), self.modifier_cols.tolist(), self.modifier_values.tolist()):
+            modifiers[self.regions[i]][self.commodity_names[j]] = value
+        return modifiers
+
+    @cached_property
+    def events_by_region(self):
+        events = {}
+        for i, region in enumerate(self.regions):
+            events[region] = []
+            for k in range(self.event_count(i)):
+                description, cols, changes = self.event(i, k)
+                events[region].append({
+                    "description": description,
+                    "effects": {self.commodity_names[j]: change for j, change in zip(cols.tolist(), changes.tolist())}
+                })
+        return events
+
+
+def _number(value, where):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise WorldError(f"{where} must be a number, not {value!r}")
+    return float(value)
+
+
+def compile_world(definition):
+    """Validate a world definition dict and compile it into a World.
+
+    The definition has the shape of worlds/default.json: ``commodities`` maps names to
+    base_price, unit and volatility; ``region_modifiers`` names every region with its
+    fractional price modifiers; ``events_by_region`` and ``transport_costs`` are optional.
+    """
+    if not isinstance(definition, dict):
+        raise WorldError("A world definition must be a JSON object")
+    commodities = definition.get("commodities")
+    region_modifiers = definition.get("region_modifiers")
+    events_by_region = definition.get("events_by_region", {})
+    transport_costs = definition.get("transport_costs", {})
+    if not isinstance(commodities, dict) or not commodities:
+        raise WorldError("commodities must be a non-empty object")
+    if not isinstance(region_modifiers, dict) or not region_modifiers:
+        raise WorldError("region_modifiers must name at least one region")
+
+    commodity_names = list(commodities)
+    commodity_index = {commodity: j for j, commodity in enumerate(commodity_names)}
+    regions = list(region_modifiers)
+    region_index = {region: i for i, region in enumerate(regions)}
+
+    def commodity_id(commodity, where):
+        if commodity not in commodity_index:
+            raise WorldError(f"{where}: unknown commodity {commodity!r}")
+        return commodity_index[commodity]
+
+    base_prices, volatilities, units = [], [], []
+    for commodity, data in commodities.items():
+        if not isinstance(data, dict):
+            raise WorldError(f"Commodity {commodity!r} must be an object")
+        base_price = _number(data.get("base_price"), f"{commodity}.base_price")
+        volatility = _number(data.get("volatility"), f"{commodity}.volatility")
+        if base_price <= 0 or volatility < 0:
+            raise WorldError(f"Commodity {commodity!r} needs a positive base_price and a non-negative volatility")
+        base_prices.append(base_price)
+        volatilities.append(volatility)
+        units.append(str(data.get("unit", "")))
+
+    modifier_rows, modifier_cols, modifier_values = [], [], []
+    for region, modifiers in region_modifiers.items():
+        for commodity, value in (modifiers or {}).items():
+            modifier_rows.append(region_index[region])
+            modifier_cols.append(commodity_id(commodity, f"region_modifiers[{region!r}]"))
+            modifier_values.append(_number(value, f"region_modifiers[{region!r}][{commodity!r}]"))
+
+    for region in events_by_region:
+        if region not in region_index:
+            raise WorldError(f"events_by_region: unknown region {region!r}")
+    event_offsets, event_descriptions = [0], []
+    effect_offsets, effect_cols, effect_values = [0], [], []
+    for region in regions:
+        for k, event in enumerate(events_by_region.get(region, [])):
+            where = f"events_by_region[{region!r}][{k}]"
+            if not isinstance(event, dict) or not isinstance(event.get("effects", {}), dict):
+                raise WorldError(f"{where} must be an object with an effects object")
+            event_descriptions.append(str(event.get("description", "")))
+            for commodity, change in event.get("effects", {}).items():
+                effect_cols.append(commodity_id(commodity, where))
+                effect_values.append(_number(change, f"{where}[{commodity!r}]"))
+            effect_offsets.append(len(effect_cols))
+        event_offsets.append(len(event_descriptions))
+
+    if not isinstance(transport_costs, dict):
+        raise WorldError("transport_costs must be an object")
+    for export_region, routes in transport_costs.items():
+        if (export_region not in region_index or not isinstance(routes, dict)
+                or not all(region in region_index for region in routes)):
+            raise WorldError(f"transport_costs[{export_region!r}]: unknown region")
+        for region, cost in routes.items():
+            _number(cost, f"transport_costs[{export_region!r}][{region!r}]")
+
+    return World({
+        "regions": np.array(regions, dtype=str),
+        "commodity_names": np.array(commodity_names, dtype=str),
+        "units": np.array(units, dtype=str),
+        "base_prices": np.array(base_prices),
+        "volatilities": np.array(volatilities),
+        "modifier_rows": np.array(modifier_rows, dtype=np.intp),
+        "modifier_cols": np.array(modifier_cols, dtype=np.intp),
+        "modifier_values": np.array(modifier_values),
+        "event_offsets": np.array(event_offsets, dtype=np.intp),
+        "event_descriptions": np.array(event_descriptions, dtype=str),
+        "effect_offsets": np.array(effect_offsets, dtype=np.intp),
+        "effect_cols": np.array(effect_cols, dtype=np.intp),
+        "effect_values": np.array(effect_values),
+        "transport_costs_json": np.array(json.dumps(transport_costs))
+    })
+
+
+def load_world(path=DEFAULT_WORLD_FILE, cache_dir=None):
+    """Load and compile the world definition file at ``path``.
+
+    Compiled tables are kept on disk in ``cache_dir`` (default ``.world_cache`` next to
+    the file) under the file's size and modification time, so a restart loads them
+    with one read instead of re-validating the definition. Within a process every
+    caller of the same unchanged file shares one World.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{COMPILE_VERSION}:{path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+
+    with _compiled_lock:
+        if key in _compiled:
+            return _compiled[key]
+
+    cache_dir = cache_dir or os.path.join(os.path.dirname(path), ".world_cache")
+    stem = os.path.splitext(os.path.basename(path))[0]
+    cache_file = os.path.join(cache_dir, f"{stem}-{key}.npz")
+    world = None
+    try:
+        with np.load(cache_file, allow_pickle=False) as data:
+            world = World({name: data[name] for name in _ARRAYS})
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        pass  # missing, or left half-written by a crash: compile again
+
+    if world is None:
+        with open(path, 'r') as f:
+            try:
+                definition = json.load(f)
+            except ValueError as e:
+                raise WorldError(f"{path}: {e}") from None
+        world = compile_world(definition)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Workers starting together each write their own temporary file
+            fd, tmp_file = tempfile.mkstemp(dir=cache_dir, prefix=f".{stem}-", suffix=".tmp.npz")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, **world._arrays)
+                os.replace(tmp_file, cache_file)
+            except BaseException:
+                os.remove(tmp_file)
+                raise
+            # Drop tables compiled from earlier versions of this file, and only of this file
+            stale = re.compile(re.escape(stem) + r"-[0-9a-f]{16}\.npz")
+            for cached in os.listdir(cache_dir):
+                if stale.fullmatch(cached) and os.path.join(cache_dir, cached) != cache_file:
+                    try:
+                        os.remove(os.path.join(cache_dir, cached))
+                    except FileNotFoundError:
+                        pass  # another worker got there first
+        except OSError:
+            pass  # a read-only checkout just compiles on every start
+
+    with _compiled_lock:
+        return _compiled.setdefault(key, world)
+
+
+def get_world(world=None):
+    """A World from a definition file path, a definition dict, or None for the default world"""
+    if isinstance(world, World):
+        return world
+    if isinstance(world, dict):
+        return compile_world(world)
+    return load_world(world or DEFAULT_WORLD_FILE)